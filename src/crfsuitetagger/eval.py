@@ -22,10 +22,11 @@ import io
 import traceback
 import random as rnd
 import warnings
+import numpy as np
 
 from os.path import join
 from bioeval import evaluate
-from .utils import export, random_str
+from .utils import export, random_str, EncodedData
 from iterpipes import check_call, cmd
 from subprocess import CalledProcessError
 
@@ -121,6 +122,8 @@ def bio(data, label_col='chunktag', inference_col='guesstag', *args, **kwargs):
     :returns: accuracy estimates
     :rtype: AccuracyResults
     """
+    if isinstance(data, EncodedData):
+        return _bio_encoded(data, label_col, inference_col)
     go, ge = set(), set()
     if data[0][label_col][0] not in 'BOS':
         raise ValueError('Invalid chunktag in first token.')
@@ -236,6 +239,8 @@ def pos(data, *args, **kwargs):
     :return: guess accuracy results by category
     :rtype: AccuracyResults
     """
+    if isinstance(data, EncodedData):
+        return _pos_encoded(data)
     cc = {}  # correct count
     ac = {}  # all count
     for it in data:
@@ -261,6 +266,94 @@ def pos(data, *args, **kwargs):
     return results
 
 
+def _bio_encoded(data, label_col, inference_col):
+    """Same as `bio`, but works on the integer codes of dictionary-encoded data
+    instead of comparing tag strings.
+
+    :param data: annotated data
+    :type data: EncodedData
+    :param label_col: chunk annotation column name
+    :type label_col: str
+    :param inference_col: guessed/inferred annotation column name
+    :type inference_col: str
+    :returns: accuracy estimates
+    :rtype: AccuracyResults
+    """
+    vs = data.vocab.strings
+
+    # codes of tags starting a chunk
+    bos = np.array([len(x) > 0 and x[0] in 'BOS' for x in vs] + [False])
+    o = data.vocab.index.get('O', -1)
+
+    go = data.codes[label_col]
+    ge = data.codes[inference_col]
+    if not bos[go[0]]:
+        raise ValueError('Invalid chunktag in first token.')
+    if not bos[ge[0]]:
+        raise ValueError('Invalid guesstag in first token.')
+
+    # chunk start indices
+    go_s = np.flatnonzero(bos[go])
+    ge_s = np.flatnonzero(bos[ge])
+
+    # chunk end indices
+    go_e = np.append(go_s[1:], len(go))
+    ge_e = np.append(ge_s[1:], len(ge))
+
+    # end of the guessed chunk starting at each index
+    ge_end = np.full(len(ge) + 1, -1)
+    ge_end[ge_s] = ge_e
+
+    # gold chunks matched by a guessed chunk with the same span and tags
+    diff = np.add.reduceat((go != ge).astype(np.int32), go_s)
+    cor = (ge_end[go_s] == go_e) & (diff == 0) & (go[go_s] != o)
+
+    gon = float(np.count_nonzero(go[go_s] != o))
+    gen = float(np.count_nonzero(ge[ge_s] != o))
+    co = float(np.count_nonzero(cor))
+
+    pr = co / gen
+    re = co / gon
+    f1 = 2 * pr * re / (pr + re)
+
+    r = AccuracyResults({'Total': {'precision': round(100 * pr, 2),
+                                   'recall': round(100 * re, 2),
+                                   'fscore': round(100 * f1, 2)}})
+    return r
+
+
+def _pos_encoded(data):
+    """Same as `pos`, but works on the integer codes of dictionary-encoded data
+    instead of comparing tag strings.
+
+    :param data: annotated data
+    :type data: EncodedData
+    :return: guess accuracy results by category
+    :rtype: AccuracyResults
+    """
+    go = data.codes['postag']
+    ge = data.codes['guesstag']
+    nv = len(data.vocab)
+
+    ac = np.bincount(go, minlength=nv)
+    cc = np.bincount(go[go == ge], minlength=nv)
+
+    results = AccuracyResults()
+
+    for t in np.flatnonzero(ac):
+        results[data.vocab.decode(t)] = {
+            'accuracy': float(cc[t]) / float(ac[t]),
+            'correct': float(cc[t]),
+            'all': float(ac[t])
+        }
+
+    tcc = float(cc.sum())
+    tac = float(ac.sum())
+    results['Total'] = {'accuracy': tcc / tac, 'correct': tcc, 'all': tac}
+
+    return results
+
+
 def ner(data, label_col='netag', inference_col='guesstag'):
     """Evaluates F1-score for NER using BIO evaluation.
 
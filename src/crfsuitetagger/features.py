@@ -16,6 +16,66 @@ __author__ = 'Aleksandar Savkov'
 
 import re
 
+_NUM_RE = re.compile('[0-9/]+')
+_DIGIT_RE = re.compile(r'\d')
+_WORD_RE = re.compile(r'\w')
+_SHAPE_RE = re.compile('[^#x]')
+
+
+class _CanTable(dict):
+    """Translate table of the canonical shape of characters, filled on
+    demand. A character is mapped as if the substitutions of digits with `#`,
+    word characters with `x`, and everything else but `#` and `x` with `*`
+    were applied to it one after the other.
+    """
+
+    def __missing__(self, c):
+        s = _DIGIT_RE.sub('#', chr(c))
+        s = _WORD_RE.sub('x', s)
+        s = _SHAPE_RE.sub('*', s)
+        self[c] = s
+        return s
+
+
+_CAN_TABLE = _CanTable()
+
+
+def can_shape(w):
+    """Returns the canonical shape of a form, e.g. `Xx-12` becomes `xx*##`.
+
+    :param w: form
+    :type w: str
+    :return: shape
+    :rtype: str
+    """
+    return w.translate(_CAN_TABLE)
+
+
+def _longest_suffix(w, sfxs, n):
+    """Returns the longest suffix of `w` of at most `n` characters that is
+    present in `sfxs`, or None. Uses the trie lookup of
+    `readers.AffixSet` when available.
+    """
+    if hasattr(sfxs, 'longest_suffix'):
+        return sfxs.longest_suffix(w, n)
+    for x in range(n, 0, -1):
+        if w[-x:] in sfxs:
+            return w[-x:]
+    return None
+
+
+def _longest_prefix(w, prfxs, n):
+    """Returns the longest prefix of `w` of at most `n` characters that is
+    present in `prfxs`, or None. Uses the trie lookup of
+    `readers.AffixSet` when available.
+    """
+    if hasattr(prfxs, 'longest_prefix'):
+        return prfxs.longest_prefix(w, n)
+    for x in range(n, 0, -1):
+        if w[:x] in prfxs:
+            return w[:x]
+    return None
+
 
 def ft_word(data, i, cols, rel=0, *args, **kwargs):
     """Generates a feature based on the `form` column.
@@ -177,9 +237,7 @@ def ft_can(data, i, cols, rel=0, *args, **kwargs):
     """
     if 0 <= i + rel < len(data):
         w = data[i + rel][cols['form']]
-        w = re.sub('\d', '#', w)
-        w = re.sub('\w', 'x', w)
-        w = re.sub('[^#x]', '*', w)
+        w = can_shape(w)
     else:
         w = None
     return 'can[%s]=%s' % (rel, w)
@@ -261,6 +319,12 @@ def ft_emb(data, i, cols, rel=0, j=0, e=None, *args, **kwargs):
     GOTCHA: some resources come with separators of 4 space characters
     (replacing a tab?), while the default is a single space.
 
+    If the embeddings are a `readers.Embeddings` matrix, the feature is
+    real-valued: a (name, weight) pair such as ('emb[0][3]', 0.1423). Unknown
+    words and positions outside of the sequence produce a `None` feature
+    string, e.g. `emb[0][3]=None`. Embeddings given as a dictionary of lists
+    (e.g. in older models) produce a feature string per value.
+
     :param data: data
     :type data: DataFrame
     :param i: index
@@ -271,8 +335,8 @@ def ft_emb(data, i, cols, rel=0, j=0, e=None, *args, **kwargs):
     :type c: dict
     :param rel: relative index
     :type rel: int
-    :return: feature string
-    :rtype: str
+    :return: feature string or name and weight
+    :rtype: str or tuple
     """
     if 0 <= i + rel < len(data):
         try:
@@ -281,6 +345,8 @@ def ft_emb(data, i, cols, rel=0, j=0, e=None, *args, **kwargs):
             emb = None
     else:
         emb = None
+    if emb is not None and hasattr(e, 'matrix'):
+        return 'emb[%s][%s]' % (rel, j), float(emb)
     return 'emb[%s][%s]=%s' % (rel, j, emb)
 
 
@@ -300,7 +366,7 @@ def ft_isnum(data, i, cols, rel=0, *args, **kwargs):
     :rtype: str
     """
     if 0 <= i + rel < len(data):
-        isnum = bool(re.match('[0-9/]+', data[i + rel][cols['form']]))
+        isnum = bool(_NUM_RE.match(data[i + rel][cols['form']]))
     else:
         isnum = None
     return 'isnum[%s]=%s' % (str(rel), isnum)
@@ -399,10 +465,7 @@ def ft_suff(data, i, cols, rel=0, sfxs=None, max_sfx=0, *args, **kwargs):
         maxs = len(w) - 1
         if max_sfx and int(max_sfx) < maxs:
             maxs = int(max_sfx)
-        # TODO turn this loop around for efficiency.
-        for s in (w[-x:] for x in range(1, maxs + 1)):
-            if s in sfxs:
-                sufx = s  # longest possible suffix
+        sufx = _longest_suffix(w, sfxs, maxs)
     return 'sfx[%s]=%s' % (str(rel), sufx)
 
 
@@ -432,10 +495,7 @@ def ft_pref(data, i, cols, rel=0, prfxs=None, max_prfx=0, *args, **kwargs):
         maxp = len(w)
         if max_prfx and int(max_prfx) < maxp:
             maxp = int(max_prfx)
-        # TODO turn this loop around for efficiency.
-        for s in (w[:x] for x in range(1, maxp + 1)):
-            if s in prfxs:
-                prfx = s  # longest possible suffix
+        prfx = _longest_prefix(w, prfxs, maxp)
     return 'sfx[%s]=%s' % (str(rel), prfx)
 
 
@@ -597,4 +657,17 @@ def ft_inflsuff(data, i, cols, rel=0, sfxs=None, max_sfx=0, *args, **kwargs):
     :return: feature
     :rtype: str
     """
-    return 'infl%s' % ft_suff(data, i, cols, rel, sfxs, max_sfx)
\ No newline at end of file
+    return 'infl%s' % ft_suff(data, i, cols, rel, sfxs, max_sfx)
+
+# Columns read by each feature function (keys of the column map). Used to work
+# out which data columns need to be parsed, see `FeatureTemplate.data_cols`.
+FT_COLS = {
+    x: ('form',) for x in ['ft_word', 'ft_nword', 'ft_can', 'ft_brown',
+                           'ft_cls', 'ft_emb', 'ft_isnum', 'ft_short',
+                           'ft_long', 'ft_ln', 'ft_suff', 'ft_pref',
+                           'ft_medpref', 'ft_medsuff', 'ft_nounsuff',
+                           'ft_verbsuff', 'ft_adjsuff', 'ft_advsuff',
+                           'ft_inflsuff']
+}
+FT_COLS.update({'ft_pos': ('postag',), 'ft_npos': ('postag',),
+                'ft_chunk': ('chunktag',), 'ft_nchunk': ('chunktag',)})
@@ -15,13 +15,21 @@
 __author__ = 'Aleksandar Savkov'
 
 import re
+import zlib
+import time
+import hashlib
+import heapq
+import numpy as np
+from collections import OrderedDict, Counter
 from . import features as fts
 from . import win_features as wf
+from . import seq_features as sf
 
 
 class FeatureTemplate:
 
-    def __init__(self, tmpl=None, fnx=None, win_fnx=None, cols=None):
+    def __init__(self, tmpl=None, fnx=None, win_fnx=None, cols=None,
+                 cache_size=0, hash_bits=0, profile=False):
         """Constructs either a FeatureTemplate object or takes parameters to
         set the template dictionary and the list of special functions.
 
@@ -53,6 +61,14 @@ class FeatureTemplate:
         :type win_fnx: list
         :param cols: map of columns names
         :type cols: dict
+        :param cache_size: number of forms in the form cache, 0 disables it
+        :type cache_size: int
+        :param hash_bits: number of bits of feature hashes, 0 disables feature
+        hashing (see `hash_fts`)
+        :type hash_bits: int
+        :param profile: enables the profiling of feature extraction (see
+        `FeatureProfile`)
+        :type profile: bool
         """
 
         self.vec = [] if tmpl is None else tmpl
@@ -74,6 +90,21 @@ class FeatureTemplate:
         if win_fnx:
             self.win_fnx.update({x.__name__: x for x in win_fnx})
 
+        # cache of the form-only attributes used by `make_seq_fts`
+        self.form_cache = FormCache(cache_size) if cache_size else None
+
+        # number of bits of feature hashes
+        self.hash_bits = hash_bits
+
+        # feature extraction profile
+        self.profile = FeatureProfile() if profile else None
+
+        # sequence-level counterparts of the built-in feature functions
+        self.seq_fnx = {
+            fts.__dict__[x]: (y, sf.__dict__['lb_%s' % x[3:]])
+            for x, y in list(sf.__dict__.items()) if x[:3] == 'ft_'
+        }
+
     def parse_ftvec_templ(self, s, r):
         """Parses a feature vector template string into a FeatureTemplate
         object.
@@ -173,6 +204,294 @@ class FeatureTemplate:
         for v in f(fn, fw, fp, *args, **kwargs):
             self.vec.append(v)
 
+    def data_cols(self, form_col='form'):
+        """Returns the names of the data columns read by the feature functions
+        in this template, including the form column. The columns of a function
+        are looked up in `features.FT_COLS` or in the `cols` attribute of the
+        function, and mapped through the column map of this template.
+
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :return: column names or None if the columns of a function are unknown
+        :rtype: set
+        """
+        c = {form_col}
+        for itm in self.vec:
+            f = itm[0]
+            func = self.fnx[f] if type(f) is str else f
+            fc = getattr(func, 'cols', fts.FT_COLS.get(func.__name__))
+            if fc is None:
+                return None
+            c.update(self.cols.get(x, x) for x in fc)
+        return c
+
+    def radius(self):
+        """Returns the largest distance between a token and the tokens its
+        features are extracted from, e.g. 2 for `word:[-2:1]` or for
+        `nword:[0:1],2`. Returns None if the template contains feature
+        functions without a sequence-level counterpart (see `seq_features`),
+        as their context is unknown.
+
+        :return: radius
+        :rtype: int
+        """
+        r = 0
+        for itm in self.vec:
+            f = itm[0]
+            func = self.fnx[f] if type(f) is str else f
+            if func not in self.seq_fnx:
+                return None
+            rel = itm[1] if len(itm) > 1 else 0
+            n = 1
+            if func in (fts.ft_nword, fts.ft_npos, fts.ft_nchunk):
+                n = int(itm[2]) if len(itm) > 2 else 2
+            r = max(r, abs(rel), abs(rel + n - 1))
+        return r
+
+    def entry_names(self):
+        """Returns the names of the columns of a feature matrix, i.e. `form`
+        followed by one name per template entry, e.g. `word[-1]`.
+
+        :return: names
+        :rtype: list
+        """
+        r = ['form']
+        for itm in self.vec:
+            n = _func_name(itm[0])
+            if len(itm) > 1 and type(itm[1]) is int:
+                n = '%s[%s]' % (n, itm[1])
+            r.append(n)
+        return r
+
+    def profile_report(self):
+        """Returns the profile of feature extraction (see `FeatureProfile`)
+        as a dict with:
+
+        -- `entries`: a list with the index, name (see `entry_names`),
+           function name, cumulative wall time in seconds, number of calls
+           and estimated number of distinct features (cardinality) of every
+           template entry
+        -- `functions`: the same totals by feature function, where the
+           cardinality is the number of distinct features of all entries of
+           the function, sorted by decreasing time
+        -- `form_cache_time`: the time spent in form cache lookups (see
+           `make_seq_fts`), which is not attributed to entries
+        -- `time`: the total time
+
+        Returns None if profiling is disabled.
+
+        :return: report
+        :rtype: dict
+        """
+        prof = self.profile
+        if prof is None:
+            return None
+        names = self.entry_names()[1:]
+        ents = []
+        fns = OrderedDict()
+        for k, itm in enumerate(self.vec):
+            fn = _func_name(itm[0])
+            e = {'index': k, 'entry': names[k], 'function': fn,
+                 'time': prof.time.get(k, 0.0), 'calls': prof.calls.get(k, 0),
+                 'cardinality': prof.cardinality([k])}
+            ents.append(e)
+            fe = fns.setdefault(fn, {'function': fn, 'time': 0.0, 'calls': 0,
+                                     'ks': []})
+            fe['time'] += e['time']
+            fe['calls'] += e['calls']
+            fe['ks'].append(k)
+        for fe in fns.values():
+            fe['cardinality'] = prof.cardinality(fe.pop('ks'))
+        return {
+            'entries': ents,
+            'functions': sorted(fns.values(), key=lambda x: -x['time']),
+            'form_cache_time': prof.cache_time,
+            'time': sum(e['time'] for e in ents) + prof.cache_time
+        }
+
+    def compile(self):
+        """Compiles the feature vector template into a single function that
+        generates the features of a whole sequence. The source of the function
+        is generated from `vec`: feature functions are resolved and function
+        parameters are bound as constants once, so that generating the
+        features of a token is a flat list of direct calls. The function takes
+        a data sequence and the name of the form column, and returns the same
+        feature matrices as calling `make_fts` for every index.
+
+        The features of each distinct template entry are computed once per
+        sequence, i.e. duplicate entries share their features. The n-grams of
+        n-gram entries (`nword`, `npos`, `nchunk`) are built once per sequence
+        and set of function parameters (see `seq_features`) and the features
+        of all relative positions are served from them.
+
+        If profiling is enabled at the time of compilation, the function
+        records the time and the features of every entry in `profile`.
+
+        Note: the function reflects the template at the time of compilation.
+
+        **FEATURE VECTOR GENERATING FUNCTION**
+
+        :return: sequence feature function
+        :rtype: function
+        """
+        prof = self.profile
+        ns = {'cols': self.cols, '_base_strs': _base_strs, '_shift': _shift,
+              '_prof': prof, '_clock': time.perf_counter}
+        src = ['def seq_fts(data, form_col=\'form\'):',
+               '    n = len(data)']
+        ents = {}
+        bases = {}
+        fcols = []
+        for k, itm in enumerate(self.vec):
+            f = itm[0]
+            func = self.fnx[f] if type(f) is str else f
+            key = _entry_key(func, itm[1:])
+            if key in ents:
+                fcols.append(ents[key])
+                if prof is not None:
+                    src.append('    _prof.add(%d, 0.0, %s)' % (k, ents[key]))
+                continue
+            c = ents[key] = 'c%d' % k
+            fcols.append(c)
+            if prof is not None:
+                src.append('    _t = _clock()')
+
+            # n-grams, shifted to the relative position of the entry
+            if func in _NGRAM_FTS:
+                rel = itm[1] if len(itm) > 1 else 0
+                p = itm[2:]
+                bf, lf = self.seq_fnx[func]
+                bk = _entry_key(bf, p)
+                if bk not in bases:
+                    bases[bk] = 'b%d' % k
+                    ns['bf%d' % k] = bf
+                    ns['bp%d' % k] = p
+                    src.append('    b%d = _base_strs(bf%d, bf%d(data, cols, '
+                               '*bp%d))' % (k, k, k, k))
+                ns['lb%d' % k] = lf(rel, *p)
+                src.append('    %s = _shift(%s, %d, lb%d, n)' %
+                           (c, bases[bk], rel, k))
+                if prof is not None:
+                    src.append('    _prof.add(%d, _clock() - _t, %s)' % (k, c))
+                continue
+
+            ns['f%d' % k] = func
+            prms = []
+            for j, p in enumerate(itm[1:]):
+                ns['p%d_%d' % (k, j)] = p
+                prms.append(', p%d_%d' % (k, j))
+            src.append('    %s = [f%d(data, i, cols%s) for i in range(n)]' %
+                       (c, k, ''.join(prms)))
+            if prof is not None:
+                src.append('    _prof.add(%d, _clock() - _t, %s)' % (k, c))
+        src.append('    return [list(x) for x in zip(data[form_col].tolist()'
+                   '%s)]\n' % ''.join(', %s' % x for x in fcols))
+        exec(compile('\n'.join(src), '<ftvec>', 'exec'), ns)
+        return ns['seq_fts']
+
+    def make_seq_fts(self, data, form_col='form'):
+        """Generates the features of all items in a sequence based on the
+        feature template embedded in this object. The output is the same as
+        that of calling `make_fts` for every index, but the base attribute of
+        every built-in feature function (see `seq_features`) is computed only
+        once per sequence and set of function parameters, e.g. the canonical
+        shape of each form is computed once for `can:[-3:3]`. The features of
+        each template entry are produced by shifting the list of attribute
+        values by the relative position of the entry. Feature functions
+        without a sequence-level counterpart are called for every item.
+        Duplicate template entries share their features.
+
+        If the form cache is enabled, the attributes that depend only on the
+        form (see `seq_features.FORM_FTS`) are looked up in it.
+
+        If profiling is enabled, the time and the features of every entry are
+        recorded in `profile`. The time of form cache lookups is recorded
+        separately.
+
+        **FEATURE VECTOR GENERATING FUNCTION**
+
+        :param data: data sequence
+        :type data: np.recarray
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :return: feature matrices
+        :rtype: list
+        """
+        n = len(data)
+        ftc = [data[form_col].tolist()]
+        prof = self.profile
+
+        # base attribute values as strings, by function and parameters
+        base = {}
+
+        if self.form_cache is not None:
+            t = time.perf_counter()
+            ents = OrderedDict()
+            for itm in self.vec:
+                f = itm[0]
+                func = self.fnx[f] if type(f) is str else f
+                bf = self.seq_fnx.get(func, (None,))[0]
+                if bf in sf.FORM_FTS:
+                    p = itm[2:]
+                    ents[_entry_key(bf, p)] = (bf, p)
+            if ents:
+                base.update(
+                    self.form_cache.attributes(data, self.cols, ents))
+            if prof is not None:
+                prof.cache_time += time.perf_counter() - t
+
+        # features by template entry, shared by duplicate entries
+        ents = {}
+
+        for k, itm in enumerate(self.vec):
+            t = time.perf_counter()
+            f = itm[0]
+            func = self.fnx[f] if type(f) is str else f
+            ek = _entry_key(func, itm[1:])
+            if ek in ents:
+                ftc.append(ents[ek])
+            elif func not in self.seq_fnx:
+                ftc.append([func(data, i, self.cols, *itm[1:])
+                            for i in range(n)])
+            else:
+                rel = itm[1] if len(itm) > 1 else 0
+                p = itm[2:]
+                bf, lf = self.seq_fnx[func]
+                bk = _entry_key(bf, p)
+                if bk not in base:
+                    base[bk] = _base_strs(bf, bf(data, self.cols, *p))
+                ftc.append(_shift(base[bk], rel, lf(rel, *p), n,
+                                  bf in sf.WEIGHTED_FTS))
+            if prof is not None:
+                prof.add(k, 0.0 if ek in ents else time.perf_counter() - t,
+                         ftc[-1])
+            ents[ek] = ftc[-1]
+
+        return [list(x) for x in zip(*ftc)]
+
+    def hash_fts(self, ftm):
+        """Hashes the features in a feature matrix into `2 ** hash_bits`
+        buckets per feature prefix. A feature is replaced by its prefix, i.e.
+        the text preceding the first `[` (e.g. `w`, `2p`, `can`) if it is at
+        most 8 characters long, followed by `#` and the bucket number, e.g.
+        `w[-1]=the` becomes `w#1618`. The bucket is the CRC-32 checksum of the
+        UTF-8 encoded feature, which is the same across processes and Python
+        versions, so models trained with hashed features can be saved and
+        loaded. Weights of real-valued attributes are kept, and the weights of
+        attributes that fall into the same bucket are summed when the items
+        are passed to pycrfsuite. Features without a prefix, e.g. the form
+        that starts each row, share the buckets of the empty prefix.
+
+        :param ftm: feature matrix
+        :type ftm: list
+        :return: hashed feature matrix
+        :rtype: list
+        """
+        m = (1 << self.hash_bits) - 1
+        return [[(_hash_ft(x[0], m), x[1]) if type(x) is tuple
+                 else _hash_ft(x, m) for x in fv]
+                for fv in ftm]
+
     def make_fts(self,
                  data,
                  i,
@@ -193,10 +512,396 @@ class FeatureTemplate:
         :rtype: list
         """
         ret = [data[i][form_col]]
+        prof = self.profile
 
-        for itm in self.vec:
+        for k, itm in enumerate(self.vec):
             f = itm[0]
             p = itm[1:]
             func = self.fnx[f] if type(f) is str else f
+            if prof is None:
+                ret.append(func(data, i, self.cols, *(p + args), **kwargs))
+                continue
+            t = time.perf_counter()
             ret.append(func(data, i, self.cols, *(p + args), **kwargs))
-        return ret
\ No newline at end of file
+            prof.add(k, time.perf_counter() - t, ret[-1:])
+        return ret
+
+
+def _func_name(f):
+    """Returns the name of a feature function without the `ft_` prefix.
+
+    :param f: feature function or its name
+    :type f: str or function
+    :return: name
+    :rtype: str
+    """
+    n = f if type(f) is str else f.__name__
+    return n[3:] if n[:3] == 'ft_' else n
+
+
+def _hash64(s):
+    """Returns a signed 64-bit hash value of a feature that is the same across
+    processes and runs (see `FeatureProfile`).
+
+    :param s: feature
+    :type s: str
+    :return: hash value
+    :rtype: int
+    """
+    s = s if isinstance(s, str) else str(s)
+    return int.from_bytes(hashlib.blake2b(s.encode('utf-8'),
+                                          digest_size=8).digest(),
+                          'little', signed=True)
+
+
+def _hash_ft(s, m):
+    """Hashes a feature (see `FeatureTemplate.hash_fts`).
+
+    :param s: feature
+    :type s: str
+    :param m: bucket mask
+    :type m: int
+    :return: hashed feature
+    :rtype: str
+    """
+    s = s if isinstance(s, str) else str(s)
+    p, sep, _ = s.partition('[')
+    if not sep or len(p) > 8:
+        p = ''
+    return '%s#%d' % (p, zlib.crc32(s.encode('utf-8')) & m)
+
+
+# n-gram feature functions
+_NGRAM_FTS = {fts.ft_nword, fts.ft_npos, fts.ft_nchunk}
+
+
+def _entry_key(func, p):
+    """Returns a key of a template entry, or of a base attribute function and
+    its parameters. Parameters that are numbers or strings are compared by
+    value, others (e.g. resources) by identity.
+
+    :param func: function
+    :type func: function
+    :param p: parameters
+    :type p: tuple
+    :return: key
+    :rtype: tuple
+    """
+    return (func,) + tuple((type(x), x) if isinstance(x, (int, float, str))
+                           else id(x) for x in p)
+
+
+def _shift(vals, rel, lb, n, weighted=False):
+    """Returns the features of a relative position: the base attribute
+    values shifted by `rel` and padded with `None` on both sides, prefixed
+    with the label `lb`. Float values of weighted attributes are turned into
+    (name, weight) pairs.
+
+    :param vals: base attribute values
+    :type vals: list
+    :param rel: relative position
+    :type rel: int
+    :param lb: label
+    :type lb: str
+    :param n: length of the sequence
+    :type n: int
+    :param weighted: whether the values may be weights
+    :type weighted: bool
+    :return: features
+    :rtype: list
+    """
+    vals = vals[max(rel, 0):max(n + min(rel, 0), 0)]
+    pad = [lb + 'None']
+    if weighted:
+        vals = [(lb[:-1], x) if type(x) is float else lb + x for x in vals]
+    else:
+        vals = [lb + x for x in vals]
+    return pad * min(max(-rel, 0), n) + vals + pad * min(max(rel, 0), n)
+
+
+def _base_strs(bf, vals):
+    """Converts base attribute values to strings, except for the values of
+    real-valued attributes (see `seq_features.WEIGHTED_FTS`).
+
+    :param bf: base attribute function
+    :type bf: function
+    :param vals: values
+    :type vals: list
+    :return: values
+    :rtype: list
+    """
+    if bf in sf.WEIGHTED_FTS:
+        return [x if type(x) is float else str(x) for x in vals]
+    return [str(x) for x in vals]
+
+
+class FormCache:
+    """A bounded LRU cache of form-only feature attributes (see
+    `seq_features.FORM_FTS`). All attributes of a form used by a feature
+    template are computed and stored together, as strings (or floats for
+    real-valued attributes). The `hits` and
+    `misses` counters count the token lookups.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        # attribute keys the cached values belong to
+        self.keys = None
+
+        self._d = OrderedDict()
+
+    def __len__(self):
+        return len(self._d)
+
+    def clear(self):
+        self._d.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def attributes(self, data, cols, ents):
+        """Returns the values of the form-only attributes of all items in a
+        sequence. The values of forms that are not in the cache are computed
+        in one batch, and the least recently used forms are evicted if the
+        cache grows over its size.
+
+        :param data: data sequence
+        :type data: np.recarray
+        :param cols: column map
+        :type cols: dict
+        :param ents: base attribute functions and parameters by attribute key
+        :type ents: OrderedDict
+        :return: attribute values as strings by attribute key
+        :rtype: dict
+        """
+        keys = tuple(ents.keys())
+        if keys != self.keys:
+            self._d.clear()
+            self.keys = keys
+
+        forms = data[cols['form']].tolist()
+        d = self._d
+        rows = {}
+        miss = []
+        for w in forms:
+            if w in rows:
+                self.hits += 1
+            elif w in d:
+                self.hits += 1
+                d.move_to_end(w)
+                rows[w] = d[w]
+            else:
+                self.misses += 1
+                rows[w] = None
+                miss.append(w)
+
+        if miss:
+            md = {cols['form']: np.array(miss)}
+            vals = [_base_strs(bf, bf(md, cols, *p))
+                    for bf, p in ents.values()]
+            for w, r in zip(miss, zip(*vals)):
+                rows[w] = d[w] = r
+            while len(d) > self.size:
+                d.popitem(last=False)
+
+        return {k: [rows[w][j] for w in forms] for j, k in enumerate(keys)}
+
+
+class FeatureCounter(Counter):
+    """Exact feature frequencies, see `CountMinSketch`."""
+
+    def update_fts(self, ftm):
+        """Counts the features in a feature matrix.
+
+        :param ftm: feature matrix
+        :type ftm: list
+        """
+        self.update(x[0] if type(x) is tuple else x for fv in ftm for x in fv)
+
+    def update_counts(self, c):
+        """Adds feature frequencies.
+
+        :param c: feature frequencies
+        :type c: dict
+        """
+        self.update(c)
+
+    def counts(self, fs):
+        """Returns the frequencies of a list of features.
+
+        :param fs: features
+        :type fs: list
+        :return: frequencies
+        :rtype: list
+        """
+        return [self[x] for x in fs]
+
+
+class CountMinSketch:
+    """Approximate feature frequencies in a fixed amount of memory. Counts are
+    kept in `depth` rows of `width` counters, each indexed by a different hash
+    function, and the frequency of a feature is estimated by the minimum of
+    its counters. Estimates are never lower than the exact frequencies.
+
+    The index of a feature in each row is a 32-bit slice of a BLAKE2b digest
+    of the UTF-8 encoded feature, so the counters, and the features kept by
+    pruning, are the same across processes and runs. The depth is at most 16.
+    """
+
+    def __init__(self, width, depth=4):
+        if not 0 < depth <= 16:
+            raise ValueError('Count-min sketch depth must be between 1 and '
+                             '16, not %s.' % depth)
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _idx(self, fs):
+        # one digest per feature, split into a 32-bit hash per row
+        ds = 4 * self.depth
+        h = np.frombuffer(b''.join(
+            hashlib.blake2b((x if isinstance(x, str) else str(x))
+                            .encode('utf-8'), digest_size=ds).digest()
+            for x in fs), dtype='<u4').reshape(-1, self.depth)
+        return [h[:, i] % self.width for i in range(self.depth)]
+
+    def update_fts(self, ftm):
+        """Counts the features in a feature matrix.
+
+        :param ftm: feature matrix
+        :type ftm: list
+        """
+        fs = [x[0] if type(x) is tuple else x for fv in ftm for x in fv]
+        for i, idx in enumerate(self._idx(fs)):
+            np.add.at(self.table[i], idx, 1)
+
+    def update_counts(self, c):
+        """Adds feature frequencies.
+
+        :param c: feature frequencies
+        :type c: dict
+        """
+        fs = list(c)
+        v = np.array([c[x] for x in fs], dtype=np.int64)
+        for i, idx in enumerate(self._idx(fs)):
+            np.add.at(self.table[i], idx, v)
+
+    def counts(self, fs):
+        """Returns the estimated frequencies of a list of features.
+
+        :param fs: features
+        :type fs: list
+        :return: frequencies
+        :rtype: np.ndarray
+        """
+        if not fs:
+            return np.zeros(0, dtype=np.int64)
+        return np.min([self.table[i][idx]
+                       for i, idx in enumerate(self._idx(fs))], axis=0)
+
+    def __getitem__(self, x):
+        return int(self.counts([x])[0])
+
+
+class FeatureProfile:
+    """Profile of feature extraction by template entry: the cumulative wall
+    time, the number of calls and the number of distinct features of every
+    entry, keyed by the entry index in `FeatureTemplate.vec`. A call is the
+    extraction of the features of one entry for a whole sequence, or for a
+    single item with `FeatureTemplate.make_fts`. Duplicate entries share the
+    features of their first occurrence and are recorded with no time.
+
+    The features themselves are not kept. The number of distinct features is
+    estimated with a k-minimum values sketch: the `k` smallest hash values of
+    the features of each entry. The estimate is exact for fewer than `k`
+    distinct features and has a relative standard error of about
+    `1 / sqrt(k)` above that. Weighted features are counted by name, i.e.
+    regardless of their weights. The hash value of a feature is a signed
+    64-bit slice of a BLAKE2b digest of the UTF-8 encoded feature, so the
+    estimates are the same across processes and runs.
+
+    Profiles of several processes are combined with `merge`. See
+    `FeatureTemplate.profile_report`.
+    """
+
+    def __init__(self, k=1024):
+        self.k = k
+        self.time = {}
+        self.calls = {}
+        self.kmv = {}
+        self.cache_time = 0.0
+
+        # largest hash value in each full sketch
+        self._max = {}
+
+    def add(self, k, dt, fts):
+        """Records a call of a template entry.
+
+        :param k: entry index
+        :type k: int
+        :param dt: time in seconds
+        :type dt: float
+        :param fts: features extracted by the call
+        :type fts: list
+        """
+        self.time[k] = self.time.get(k, 0.0) + dt
+        self.calls[k] = self.calls.get(k, 0) + 1
+        fs = set(fts)
+        if tuple in set(map(type, fs)):
+            fs = set(x[0] if type(x) is tuple else x for x in fs)
+        self._update(k, map(_hash64, fs))
+
+    def _update(self, k, hs):
+        # adds hash values to the sketch of an entry, keeping the k smallest
+        s = self.kmv.get(k)
+        if s is None:
+            s = self.kmv[k] = set()
+        m = self._max.get(k)
+        s.update(hs if m is None else filter(m.__gt__, hs))
+        if len(s) > self.k:
+            hs = heapq.nsmallest(self.k, s)
+            self.kmv[k] = set(hs)
+            self._max[k] = hs[-1]
+        elif m is None and len(s) == self.k:
+            self._max[k] = max(s)
+
+    def cardinality(self, ks):
+        """Returns the estimated number of distinct features of one or more
+        template entries.
+
+        :param ks: entry indices
+        :type ks: list
+        :return: number of distinct features
+        :rtype: int
+        """
+        s = set()
+        for k in ks:
+            s.update(self.kmv.get(k, ()))
+        if len(s) < self.k:
+            return len(s)
+        m = heapq.nsmallest(self.k, s)[-1]
+        return int(round((self.k - 1) * 2 ** 64 / (m + 2 ** 63 + 1)))
+
+    def merge(self, other):
+        """Adds the records of another profile to this one.
+
+        :param other: profile
+        :type other: FeatureProfile
+        """
+        for k, dt in other.time.items():
+            self.time[k] = self.time.get(k, 0.0) + dt
+        for k, c in other.calls.items():
+            self.calls[k] = self.calls.get(k, 0) + c
+        for k, s in other.kmv.items():
+            self._update(k, s)
+        self.cache_time += other.cache_time
+
+    def clear(self):
+        """Removes all records."""
+        self.time.clear()
+        self.calls.clear()
+        self.kmv.clear()
+        self._max.clear()
+        self.cache_time = 0.0
@@ -14,43 +14,165 @@
 # along with CRFSuiteTagger.  If not, see <http://www.gnu.org/licenses/>.
 __author__ = 'Aleksandar Savkov'
 
-import gzip
-
-from os.path import expanduser
+import numpy as np
+from .utils import open_file
 
 
 def read_cls(cp):
     r = []
-    with open(expanduser(cp), 'r') as f:
+    with open_file(cp, 'r') as f:
         for l in f:
             r.append(l.rstrip().split('\t'))
     return {x[0]: x[1] for x in r}
 
 
 def read_emb(ep):
-    if ep.endswith('.gz'):
-        with gzip.open(ep, 'rb') as f:
-            r = []
-            for l in f:
-                r.append(l.split(' '))
-    else:
-        r = []
-        with open(expanduser(ep), 'r') as f:
-            for l in f:
-                r.append(l.strip().split(' '))
-    return {x[0]: x[1:] for x in r}
+    """Reads word embeddings from a text file with one word and its vector
+    per line. Blank lines and a word2vec `<count> <dim>` header line are
+    skipped.
+
+    :param ep: file path
+    :type ep: str
+    :return: embeddings
+    :rtype: Embeddings
+    :raise ValueError: if a vector is not numeric or its dimension differs
+    from that of the first vector (or the header)
+    """
+    words = []
+    vecs = []
+    dim = None
+    with open_file(ep, 'r') as f:
+        for n, l in enumerate(f, 1):
+            x = l.split()
+            if not x:
+                continue
+            if not words and dim is None and len(x) == 2 and \
+                    x[0].isdigit() and x[1].isdigit():
+                dim = int(x[1])
+                continue
+            if dim is None:
+                dim = len(x) - 1
+            if len(x) - 1 != dim:
+                raise ValueError(
+                    'Embedding of dimension %d instead of %d on line %d of '
+                    '%s: %r' % (len(x) - 1, dim, n, ep, l.rstrip()))
+            try:
+                vecs.append([float(v) for v in x[1:]])
+            except ValueError:
+                raise ValueError('Non-numeric embedding on line %d of %s: %r'
+                                 % (n, ep, l.rstrip()))
+            words.append(x[0])
+    return Embeddings(words, np.array(vecs, dtype=np.float32))
 
 
 def read_brown(bp):
     r = []
-    with open(expanduser(bp), 'r') as f:
+    with open_file(bp, 'r') as f:
         for l in f:
             r.append(l.strip().split('\t'))
     return {x[1]: x[0] for x in r}
 
 
 def _read_afixes(ap):
-    return set(open(ap, 'r').read().split('\n'))
+    with open_file(ap, 'r') as f:
+        return AffixSet(f.read().split('\n'))
+
+
+class Embeddings:
+    """Word embeddings stored in a float32 matrix with one row per word and
+    an index of the row of each word. Embeddings are used as real-valued
+    (weighted) features, see `features.ft_emb`.
+    """
+
+    def __init__(self, words, matrix):
+        self.index = {w: i for i, w in enumerate(words)}
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, w):
+        return w in self.index
+
+    def __getitem__(self, w):
+        return self.matrix[self.index[w]]
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+
+class AffixSet(set):
+    """A set of affixes that supports longest prefix and suffix lookups. The
+    lookups walk a forward (prefix) or a reversed (suffix) character trie of
+    the affixes, built on first use, and stop at the first character that
+    does not continue any affix. The tries are not updated if the set is
+    modified afterwards.
+    """
+
+    def __init__(self, *args):
+        set.__init__(self, *args)
+        self._ptrie = None
+        self._strie = None
+
+    @staticmethod
+    def _trie(afixes):
+        root = {}
+        for a in afixes:
+            if not a:
+                continue
+            node = root
+            for c in a:
+                node = node.setdefault(c, {})
+            # end of affix marker
+            node[''] = True
+        return root
+
+    def longest_prefix(self, w, n):
+        """Returns the longest prefix of `w` in the set that is at most `n`
+        characters long.
+
+        :param w: word
+        :type w: str
+        :param n: max prefix length
+        :type n: int
+        :return: prefix or None
+        :rtype: str
+        """
+        if self._ptrie is None:
+            self._ptrie = self._trie(self)
+        node = self._ptrie
+        best = 0
+        for k in range(n):
+            node = node.get(w[k])
+            if node is None:
+                break
+            if '' in node:
+                best = k + 1
+        return w[:best] if best else None
+
+    def longest_suffix(self, w, n):
+        """Returns the longest suffix of `w` in the set that is at most `n`
+        characters long.
+
+        :param w: word
+        :type w: str
+        :param n: max suffix length
+        :type n: int
+        :return: suffix or None
+        :rtype: str
+        """
+        if self._strie is None:
+            self._strie = self._trie(x[::-1] for x in self)
+        node = self._strie
+        best = 0
+        for k in range(1, n + 1):
+            node = node.get(w[-k])
+            if node is None:
+                break
+            if '' in node:
+                best = k
+        return w[-best:] if best else None
 
 
 def read_pref(pp):
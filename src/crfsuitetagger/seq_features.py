@@ -0,0 +1,254 @@
+# This file is part of CRFSuiteTagger.
+#
+# CRFSuiteTagger is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CRFSuiteTagger is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CRFSuiteTagger.  If not, see <http://www.gnu.org/licenses/>.
+"""Sequence-level counterparts of the feature functions in `features.py`.
+
+Every feature function `features.ft_<name>` supported here is split in two
+functions:
+
+-- `ft_<name>(data, cols, *params)` computes the base attribute of every token
+   in a sequence at once, e.g. the canonical shape of every form, and returns
+   the list of attribute values.
+-- `lb_<name>(rel, *params)` returns the feature label for a relative position,
+   i.e. the text preceding the attribute value in the output of
+   `features.ft_<name>`, e.g. `can[-1]=`.
+
+The feature of token `i` at relative position `rel` is the label followed by
+the base value of token `i + rel`, or by `None` if that token is outside of
+the sequence. See `FeatureTemplate.make_seq_fts`.
+"""
+__author__ = 'Aleksandar Savkov'
+
+from .features import _longest_suffix, _longest_prefix, _NUM_RE, can_shape
+
+
+def _forms(data, cols):
+    return data[cols['form']].tolist()
+
+
+def _per_form(f, forms):
+    # applies `f` once per unique form
+    m = {w: f(w) for w in set(forms)}
+    return [m[w] for w in forms]
+
+
+def _ngrams(vals, n):
+    # all n-grams in a single pass over the n shifted value lists
+    n = int(n)
+    if n == 1:
+        ngs = list(vals)
+    elif n == 2:
+        ngs = [a + b for a, b in zip(vals, vals[1:])]
+    else:
+        ngs = [''.join(x) for x in zip(*[vals[k:] for k in range(n)])]
+    return ngs + [None] * min(n - 1, len(vals))
+
+
+def _suff(w, sfxs, max_sfx):
+    maxs = len(w) - 1
+    if max_sfx and int(max_sfx) < maxs:
+        maxs = int(max_sfx)
+    return _longest_suffix(w, sfxs, maxs)
+
+
+def _pref(w, prfxs, max_prfx):
+    maxp = len(w)
+    if max_prfx and int(max_prfx) < maxp:
+        maxp = int(max_prfx)
+    return _longest_prefix(w, prfxs, maxp)
+
+
+def ft_word(data, cols, *args):
+    return _forms(data, cols)
+
+
+def lb_word(rel, *args):
+    return 'w[%s]=' % rel
+
+
+def ft_nword(data, cols, n=None, *args):
+    return _ngrams(_forms(data, cols), n)
+
+
+def lb_nword(rel, n=None, *args):
+    return '%sw[%s]=' % (n, rel)
+
+
+def ft_pos(data, cols, *args):
+    return data[cols['postag']].tolist()
+
+
+def lb_pos(rel, *args):
+    return 'p[%s]=' % rel
+
+
+def ft_npos(data, cols, n=2, *args):
+    return _ngrams(data[cols['postag']].tolist(), n)
+
+
+def lb_npos(rel, n=2, *args):
+    return '%sp[%s]=' % (n, rel)
+
+
+def ft_chunk(data, cols, *args):
+    return data[cols['chunktag']].tolist()
+
+
+def lb_chunk(rel, *args):
+    return 'ch[%s]=' % rel
+
+
+def ft_nchunk(data, cols, n=None, *args):
+    return _ngrams(data[cols['chunktag']].tolist(), n)
+
+
+def lb_nchunk(rel, n=None, *args):
+    return '%sp[%s]=' % (n, rel)
+
+
+def ft_can(data, cols, *args):
+    return _per_form(can_shape, _forms(data, cols))
+
+
+def lb_can(rel, *args):
+    return 'can[%s]=' % rel
+
+
+def ft_brown(data, cols, b=None, p=None, *args):
+    r = []
+    for w in _forms(data, cols):
+        cname = None
+        try:
+            cname = b[w]
+            if p:
+                cname = cname[:int(p)]
+        except KeyError:
+            pass
+        r.append(cname)
+    return r
+
+
+def lb_brown(rel, b=None, p=None, *args):
+    return 'cn[%s]:%s=' % (rel, p if p else 'full')
+
+
+def ft_cls(data, cols, c=None, *args):
+    return [c.get(w) for w in _forms(data, cols)]
+
+
+def lb_cls(rel, *args):
+    return 'cnum[%s]=' % rel
+
+
+def ft_emb(data, cols, j=0, e=None, *args):
+    if hasattr(e, 'matrix'):
+        return [float(e[w][j]) if w in e else None
+                for w in _forms(data, cols)]
+    return [e[w][j] if w in e else None for w in _forms(data, cols)]
+
+
+def lb_emb(rel, j=0, *args):
+    return 'emb[%s][%s]=' % (rel, j)
+
+
+def ft_isnum(data, cols, *args):
+    return _per_form(lambda w: bool(_NUM_RE.match(w)), _forms(data, cols))
+
+
+def lb_isnum(rel, *args):
+    return 'isnum[%s]=' % rel
+
+
+def ft_short(data, cols, p=2, *args):
+    return [len(w) < p for w in _forms(data, cols)]
+
+
+def lb_short(rel, *args):
+    return 'short[%s]=' % rel
+
+
+def ft_long(data, cols, p=12, *args):
+    return [len(w) > p for w in _forms(data, cols)]
+
+
+def lb_long(rel, *args):
+    return 'long[%s]=' % rel
+
+
+def ft_ln(data, cols, *args):
+    return [len(w) for w in _forms(data, cols)]
+
+
+def lb_ln(rel, *args):
+    return 'ln[%s]=' % rel
+
+
+def ft_suff(data, cols, sfxs=None, max_sfx=0, *args):
+    return [_suff(w, sfxs, max_sfx) for w in _forms(data, cols)]
+
+
+def lb_suff(rel, *args):
+    return 'sfx[%s]=' % rel
+
+
+def ft_pref(data, cols, prfxs=None, max_prfx=0, *args):
+    return [_pref(w, prfxs, max_prfx) for w in _forms(data, cols)]
+
+
+def lb_pref(rel, *args):
+    return 'sfx[%s]=' % rel
+
+
+ft_medpref = ft_pref
+ft_medsuff = ft_nounsuff = ft_verbsuff = ft_adjsuff = ft_advsuff = \
+    ft_inflsuff = ft_suff
+
+
+def lb_medpref(rel, *args):
+    return 'med%s' % lb_pref(rel)
+
+
+def lb_medsuff(rel, *args):
+    return 'med%s' % lb_suff(rel)
+
+
+def lb_nounsuff(rel, *args):
+    return 'noun%s' % lb_suff(rel)
+
+
+def lb_verbsuff(rel, *args):
+    return 'verb%s' % lb_suff(rel)
+
+
+def lb_adjsuff(rel, *args):
+    return 'adj%s' % lb_suff(rel)
+
+
+def lb_advsuff(rel, *args):
+    return 'adv%s' % lb_suff(rel)
+
+
+def lb_inflsuff(rel, *args):
+    return 'infl%s' % lb_suff(rel)
+
+
+# base attribute functions that may produce real-valued attributes: float
+# values are turned into (name, weight) pairs, where the name is the label
+# without the trailing `=`
+WEIGHTED_FTS = {ft_emb}
+
+# base attribute functions that depend only on the form, i.e. their values can
+# be cached by form (see `ftex.FormCache`)
+FORM_FTS = {ft_can, ft_brown, ft_cls, ft_emb, ft_isnum, ft_short, ft_long,
+            ft_ln, ft_suff, ft_pref}
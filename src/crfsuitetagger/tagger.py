@@ -15,21 +15,126 @@
 
 __author__ = 'Aleksandar Savkov'
 
-import re
-import copy
 from . import eval
+import os
+import zlib
 import pickle
+import hashlib
+import json
 from . import readers
 import shutil
 import numpy as np
 import marshal
 import types
+import itertools
+import multiprocessing
 
+from collections import deque
 from os import makedirs
 from os.path import dirname, expanduser
-from .ftex import FeatureTemplate
-from .utils import parse_tsv, gsequences, expandpaths, clean_cfg
-from pycrfsuite import Trainer, Tagger
+from .ftex import FeatureTemplate, FeatureCounter, CountMinSketch
+from .utils import parse_tsv, gsequences, expandpaths, clean_cfg, \
+    save_cached_corpus, sequence_offsets, data_chunks, \
+    concat_chunks, is_sharded, shard_paths, ShardedCorpus, Vocabulary, \
+    EncodedData, Canonicaliser, CanonicalView, data_fingerprint, \
+    file_fingerprint
+from pycrfsuite import Trainer, Tagger, ItemSequence
+
+# tagger, data, sequence offsets, and feature frequencies (`_worker_items`) or
+# whether to return the feature matrices (`_worker_counts`) used by feature
+# extraction workers, which inherit them from the parent process (see
+# `CRFSTagger._map_blocks`)
+_WORKER = None
+
+
+def _worker_items(args):
+    i, j, form_col = args
+    t, d, o, cnt = _WORKER
+    if cnt is not None:
+        t.pruning = [(n, 0, 0) for n, _, _ in t.pruning]
+    if t.ft_tmpl.profile is not None:
+        t.ft_tmpl.profile.clear()
+    r = [_encode_items(x)
+         for x in t._seq_items(d, o[i:j + 1], form_col, cnt)]
+    return r, t.pruning, t.ft_tmpl.profile
+
+
+def _worker_counts(args):
+    i, j, form_col = args
+    t, d, o, spill = _WORKER
+    if t.ft_tmpl.profile is not None:
+        t.ft_tmpl.profile.clear()
+    c = FeatureCounter()
+    ftms = [] if spill else None
+    for ftm in t._seq_feature_matrices(d, o[i:j + 1], form_col):
+        c.update_fts(ftm)
+        if spill:
+            ftms.append(_encode_items(ftm))
+    return c, ftms, t.ft_tmpl.profile
+
+
+def _encode_items(items):
+    """Joins the items of a sequence that consist only of attribute names into
+    a single string, which is much faster to pass between processes than a
+    list of lists. Other sequences are returned as they are.
+
+    :param items: items
+    :type items: list
+    :return: encoded items
+    :rtype: str or list
+    """
+    n = 0
+    for it in items:
+        if type(it) is not list:
+            return items
+        n += len(it)
+    try:
+        s = '\x01'.join(['\x00'.join(it) for it in items])
+    except TypeError:
+        return items
+
+    # separators in attribute names or empty items cannot be decoded
+    if s.count('\x00') != n - len(items) or \
+            s.count('\x01') != len(items) - 1:
+        return items
+    return s
+
+
+def _dump_block(f, k, v):
+    # feature cache record: a key and a compressed pickled value
+    pickle.dump((k, zlib.compress(pickle.dumps(v, -1), 1)), f, -1)
+
+
+def _decode_items(r):
+    if type(r) is str:
+        return [x.split('\x00') for x in r.split('\x01')]
+    return r
+
+
+def _param_key(p, res):
+    """Returns a representation of a feature template parameter that is the
+    same across processes (see `CRFSTagger._feature_cache_path`). Loaded
+    resources are represented by their names, since the contents of their
+    files are part of the cache key, sets by their sorted elements, and other
+    objects by an MD5 digest of their pickled value.
+
+    :param p: parameter
+    :param res: resource names by resource object id
+    :type res: dict
+    :return: key
+    """
+    if id(p) in res:
+        return 'resource:%s' % res[id(p)]
+    if p is None or isinstance(p, (str, bytes, bool, int, float)):
+        return p
+    if isinstance(p, (list, tuple)):
+        return [_param_key(x, res) for x in p]
+    if isinstance(p, (set, frozenset)):
+        return sorted(repr(_param_key(x, res)) for x in p)
+    if isinstance(p, dict):
+        return [(_param_key(k, res), _param_key(v, res))
+                for k, v in p.items()]
+    return hashlib.md5(pickle.dumps(p, -1)).hexdigest()
 
 
 class CRFSTagger:
@@ -57,9 +162,15 @@ class CRFSTagger:
         self.train_data = None
         self.test_data = None
 
+        # vocabulary shared by dictionary-encoded data
+        self.vocab = Vocabulary()
+
         # instance of pycrfsuite.Tagger
         self.tagger = None
 
+        # feature occurrences kept and dropped by the last pruning pre-pass
+        self.pruning = None
+
         self.verbose = verbose
 
         # attempt to import cannonical replacements
@@ -82,9 +193,6 @@ class CRFSTagger:
             # loading resources (clusters, embeddings, etc.)
             self._load_resources()
 
-            # loading data
-            self._load_data()
-
         # load model
         elif mp:
             m = pickle.load(open(mp, 'r'))
@@ -101,10 +209,17 @@ class CRFSTagger:
             )
 
         # parsing feature template
-        self.ft_tmpl = FeatureTemplate(fnx=self.fnx, win_fnx=self.win_fnx, cols=self.ft_tmpl_cols)
+        self.ft_tmpl = FeatureTemplate(fnx=self.fnx, win_fnx=self.win_fnx, cols=self.ft_tmpl_cols,
+                                       cache_size=self.form_cache_size,
+                                       hash_bits=self.feature_hashing,
+                                       profile=self.ft_profile)
         self.ft_tmpl.parse_ftvec_templ(self.cfg_tag.get('ftvec'),
                                        self.resources)
 
+        # loading data (after the feature template, see `data_cols`)
+        if cfg:
+            self._load_data()
+
     @property
     def cfg_tag(self):
         """Configuration parameters of this tagger. Returns a section from a
@@ -169,6 +284,72 @@ class CRFSTagger:
     def model_path(self):
         return self.cfg_tag['model']
 
+    @property
+    def corpus_cache(self):
+        return self.cfg.getboolean('tagger', 'corpus_cache', fallback=False)
+
+    @property
+    def n_jobs(self):
+        return int(self.cfg_tag.get('n_jobs', 1))
+
+    @property
+    def encode_data(self):
+        return self.cfg.getboolean('tagger', 'encode_data', fallback=False)
+
+    @property
+    def ft_engine(self):
+        return self.cfg_tag.get('ft_engine', 'sequence')
+
+    @property
+    def form_cache_size(self):
+        return int(self.cfg_tag.get('form_cache_size', 0))
+
+    @property
+    def feature_hashing(self):
+        b = int(self.cfg_tag.get('feature_hashing', 0))
+        if not 0 <= b <= 32:
+            raise ValueError('Feature hashing takes between 0 and 32 bits, '
+                             'not %s.' % b)
+        return b
+
+    @property
+    def ft_min_freq(self):
+        return int(self.cfg_tag.get('ft_min_freq', 0))
+
+    @property
+    def ft_sketch_width(self):
+        return int(self.cfg_tag.get('ft_sketch_width', 0))
+
+    @property
+    def ft_profile(self):
+        return self.cfg.getboolean('tagger', 'ft_profile', fallback=False)
+
+    @property
+    def feature_cache(self):
+        return self.cfg_tag.get('feature_cache') or None
+
+    @property
+    def project_cols(self):
+        return self.cfg.getboolean('tagger', 'project_cols', fallback=False)
+
+    @property
+    def data_cols(self):
+        """Names of the data columns used by this tagger, i.e. the columns
+        needed by the feature template, the label column, and the columns
+        needed by the evaluation function. None if the columns used by some
+        feature function are unknown.
+
+        :return: column names
+        :rtype: set
+        """
+        c = self.ft_tmpl.data_cols(self.form_col)
+        if c is None:
+            return None
+        c.add(self.lbl_col)
+        ec = {'pos': ['postag'], 'conll': ['form', 'postag', 'chunktag']}
+        c.update(ec.get(self.cfg_tag.get('eval_func'), []))
+        return c
+
     @property
     def eval_func(self):
         return getattr(eval, '%s' % self.cfg_tag['eval_func'])
@@ -197,88 +378,565 @@ class CRFSTagger:
         configuration.
         """
         if 'train' in self.cfg_tag and self.cfg_tag['train']:
-            self.train_data = parse_tsv(
-                self.cfg_tag['train'],
-                cols=self.cols,
-                ts=self.ts
-            )
+            self.train_data = self._load_corpus(self.cfg_tag['train'])
 
         if 'test' in self.cfg_tag and self.cfg_tag['test']:
-            self.test_data = parse_tsv(
-                fp=self.cfg_tag['test'],
-                cols=self.cols,
-                ts=self.ts
-            )
+            self.test_data = self._load_corpus(self.cfg_tag['test'])
+
+    def _load_corpus(self, fp):
+        """Parses a TSV data file. If `corpus_cache` is enabled in the
+        configuration, a fresh binary cache of the file parsed with the same
+        separator and columns is used instead if available, and a cache is
+        written after parsing (see `utils.save_cached_corpus`).
+
+        If the path is a glob pattern or a manifest file (see
+        `utils.shard_paths`), a `ShardedCorpus` is returned instead. Its shards
+        are parsed one by one when the data is used.
+
+        If `project_cols` is enabled in the configuration, only the columns
+        listed in `data_cols` are parsed.
+
+        :param fp: file path
+        :type fp: str
+        :return: data
+        :rtype: np.recarray or ShardedCorpus
+        """
+        uc = self.data_cols if self.project_cols else None
+        if is_sharded(fp):
+            return ShardedCorpus(shard_paths(fp), n_jobs=self.n_jobs,
+                                 cols=self.cols, ts=self.ts,
+                                 encode=self.encode_data, vocab=self.vocab,
+                                 usecols=uc)
+        d = parse_tsv(fp=fp, cols=self.cols, ts=self.ts,
+                      encode=self.encode_data, vocab=self.vocab,
+                      n_jobs=self.n_jobs, usecols=uc,
+                      cache=self.corpus_cache)
+        if self.corpus_cache and type(d) is np.ndarray:
+            save_cached_corpus(d, fp, self.ts)
+        return d
 
     def _load_function(self, name, code_string):
         code = marshal.loads(code_string)
         return types.FunctionType(code, globals(), name)
 
-    def _extract_features(self, doc, form_col='form'):
+    def _extract_features(self, doc, form_col='form', counts=None,
+                          n_jobs=1, pruned=None, dfp=None, ftms=None):
         """A generator methof that extracts features from the data using a
-        feature set template. Yields the feature vector of each sequence in the
-        data.
+        feature set template. Yields the features of each sequence in the data
+        as a `pycrfsuite.ItemSequence`, which is passed to the trainer or the
+        tagger as it is. Features are not truncated.
+
+        Feature functions may return a (name, weight) tuple instead of a name
+        to produce a real-valued attribute. Items with such attributes are
+        passed as attribute-weight dicts, and all other items as lists of
+        attribute names, i.e. with a weight of 1.0.
+
+        If feature frequencies are provided, features less frequent than
+        `ft_min_freq` are dropped (see `_prune`).
+
+        If `feature_cache` is set, the features are read from the feature
+        cache if it holds them, and written to it otherwise (see
+        `_feature_cache_path`). Pruned features are cached only if `pruned`
+        identifies the data the frequencies were counted on.
+
+        If the feature matrices of the data are provided, e.g. by a counting
+        pass (see `_count_features`), they are pruned and converted into items
+        instead of extracting the features again.
 
         :param doc: data
         :type doc: np.recarray
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param counts: feature frequencies
+        :type counts: FeatureCounter or CountMinSketch
+        :param n_jobs: number of feature extraction processes
+        :type n_jobs: int
+        :param pruned: fingerprint of the data used to count the frequencies
+        :type pruned: str
+        :param dfp: fingerprint of the data (see `_data_fingerprint`)
+        :type dfp: str
+        :param ftms: feature matrices of the data
+        :type ftms: iterable
         """
-        d = copy.deepcopy(doc)
+        cp = None
+        if counts is None or pruned is not None:
+            cp = self._feature_cache_path(doc, form_col, pruned, dfp)
 
-        # replace tokens with canonical forms
-        if self.canonical:
-            for t in d:
-                for r in list(self.canonical.keys()):
-                    if re.match(r, t['form']):
-                        t['form'] = self.canonical[r]
+        if cp and os.path.exists(cp):
+            for x in self._read_feature_cache(cp):
+                yield x
+            return
 
-        # number of features
-        nft = len(self.ft_tmpl.vec)
+        # pruned features are cached only along with their frequencies
+        if (counts is None) != (pruned is None):
+            cp = None
 
-        # record count
-        rc = len(d)
+        if ftms is None:
+            seqs = self._encoded_items(doc, form_col, counts, n_jobs)
+        else:
+            seqs = (self._ftm_items(ftm, counts) for ftm in ftms)
+        if not cp:
+            for r in seqs:
+                yield ItemSequence(_decode_items(r))
+            return
+
+        # writing the cache next to its final path until it is complete
+        tmp = '%s.%d.tmp' % (cp, os.getpid())
+        pr = list(self.pruning) if counts is not None else None
+        try:
+            with open(tmp, 'wb') as f:
+                blk = []
+                for r in seqs:
+                    blk.append(r if type(r) is str else _encode_items(r))
+                    if len(blk) == 1000:
+                        _dump_block(f, 'items', blk)
+                        blk = []
+                    yield ItemSequence(_decode_items(r))
+                if blk:
+                    _dump_block(f, 'items', blk)
+                if pr:
+                    pr = [(n, k2 - k, dr2 - dr) for (n, k, dr), (_, k2, dr2)
+                          in zip(pr, self.pruning)]
+                _dump_block(f, 'end', pr)
+            os.replace(tmp, cp)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _encoded_items(self, doc, form_col='form', counts=None, n_jobs=1):
+        """A generator method that yields the items of each sequence in the
+        data, either as a list or encoded by `_encode_items` (see
+        `_extract_features`).
 
-        # recarray data types (60 >= char string, [30 >= char string] * nft)
-        dt = 'a60,{}'.format(','.join('a30' for _ in range(nft)))
+        :param doc: data
+        :type doc: np.recarray
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param counts: feature frequencies
+        :type counts: FeatureCounter or CountMinSketch
+        :param n_jobs: number of feature extraction processes
+        :type n_jobs: int
+        """
+        o = sequence_offsets(doc)
+        blocks = self._map_blocks(_worker_items, doc, o, form_col, n_jobs,
+                                  counts)
+        if blocks is None:
+            for items in self._seq_items(doc, o, form_col, counts):
+                yield items
+            return
+
+        for r, pr, prof in blocks:
+            if prof is not None:
+                self.ft_tmpl.profile.merge(prof)
+            if counts is not None:
+                self.pruning = [(n, k + k2, dr + dr2)
+                                for (n, k, dr), (_, k2, dr2)
+                                in zip(self.pruning, pr)]
+            for items in r:
+                yield items
+
+    def _data_fingerprint(self, doc, form_col='form'):
+        """Returns the fingerprint of the data columns read by the feature
+        template and of the sequence boundaries (see
+        `utils.data_fingerprint`). All columns but the inference label column
+        are fingerprinted if the columns read by the template are unknown.
 
-        # constructing empty recarray
-        fts = np.zeros(rc, dtype=dt)
+        :param doc: data
+        :type doc: np.recarray
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :return: fingerprint
+        :rtype: str
+        """
+        cols = self.ft_tmpl.data_cols(form_col)
+        if cols is None:
+            cols = [x for x in doc.dtype.names if x != self.ilbl_col]
+        return data_fingerprint(doc, cols)
+
+    def _feature_cache_path(self, doc, form_col='form', pruned=None,
+                            dfp=None):
+        """Returns the path of the features of the data in the feature cache
+        directory, or None if `feature_cache` is not set. The file name is an
+        MD5 digest of everything the features depend on: the data columns
+        read by the feature template and the sequence boundaries (see
+        `_data_fingerprint`), the entries of the feature template,
+        including those added programmatically (see `_param_key`), the column
+        map, the feature functions provided by the user, the contents of the
+        resource files, the canonical replacements in the order in which they
+        are applied, feature hashing, and the
+        pruning options together with the fingerprint of the data the feature
+        frequencies were counted on. The data is not read if its fingerprint
+        is provided.
 
-        # sequence start and end indices
-        s, e = 0, 0
+        :param doc: data
+        :type doc: np.recarray
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param pruned: fingerprint of the data used to count the frequencies
+        :type pruned: str
+        :param dfp: fingerprint of the data (see `_data_fingerprint`)
+        :type dfp: str
+        :return: file path
+        :rtype: str
+        """
+        if not self.feature_cache:
+            return None
+        try:
+            makedirs(self.feature_cache)
+        except OSError:
+            pass
 
-        sc = 0
+        if getattr(self, '_res_fp', None) is None:
+            self._res_fp = [
+                (n, file_fingerprint(p) if os.path.isfile(p) else p)
+                for n, p in sorted(self.cfg_res.items())
+            ]
+
+        if dfp is None:
+            dfp = self._data_fingerprint(doc, form_col)
+        fnx = [(f.__name__, marshal.dumps(f.__code__))
+               for f in (self.fnx or []) + (self.win_fnx or [])]
+        res = {id(v): n for n, v in (self.resources or {}).items()}
+        vec = [(itm[0] if type(itm[0]) is str else itm[0].__name__,
+                _param_key(itm[1:], res)) for itm in self.ft_tmpl.vec]
+        h = hashlib.md5()
+        for x in [dfp, vec,
+                  form_col, sorted(self.ft_tmpl.cols.items()), fnx,
+                  self._res_fp,
+                  list(self.canonical.items()) if self.canonical else None,
+                  self.ft_tmpl.hash_bits,
+                  (self.ft_min_freq, self.ft_sketch_width, pruned)
+                  if pruned else None]:
+            h.update(repr(x).encode('utf-8'))
+        return os.path.join(self.feature_cache, '%s.fts' % h.hexdigest())
+
+    def _read_feature_cache(self, cp):
+        """A generator method that yields the item sequences stored in a
+        feature cache file, and adds the stored pruning counts to `pruning`.
+        A cache file is a series of pickled records, each holding a key and a
+        zlib-compressed pickled value: blocks of up to 1000 encoded item
+        sequences (see `_encode_items`), and a final record with the pruning
+        counts of the data.
+
+        :param cp: file path
+        :type cp: str
+        """
+        with open(cp, 'rb') as f:
+            while True:
+                k, v = pickle.load(f)
+                v = pickle.loads(zlib.decompress(v))
+                if k == 'end':
+                    break
+                for r in v:
+                    yield ItemSequence(_decode_items(r))
+        if v and self.pruning:
+            self.pruning = [(n, k + k2, dr + dr2) for (n, k, dr), (_, k2, dr2)
+                            in zip(self.pruning, v)]
+
+    def _map_blocks(self, func, doc, o, form_col, n_jobs, arg=None):
+        """Splits the sequences of the data into blocks and maps a worker
+        function over the blocks in a pool of `n_jobs` forked processes, each
+        with its own copy of this tagger, i.e. of the feature template and
+        resources. At most 2 blocks per process are processed ahead. Returns a
+        generator of the results in the original order of the blocks, or None
+        if the data should be processed in this process, i.e. if `n_jobs` is
+        less than 2, there is a single sequence, or the platform does not
+        support `fork`.
+
+        :param func: worker function
+        :type func: function
+        :param doc: data
+        :type doc: np.recarray
+        :param o: sequence offsets
+        :type o: np.array
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param n_jobs: number of processes
+        :type n_jobs: int
+        :param arg: feature frequencies passed to `_worker_items`, or whether
+        `_worker_counts` returns the feature matrices
+        :type arg: FeatureCounter or CountMinSketch or bool
+        :return: generator of block results
+        :rtype: generator
+        """
+        n = len(o) - 1
+        if n_jobs < 2 or n < 2:
+            return None
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            return None
 
-        # extracting features sequences by sequence
-        while 0 <= s < len(d):
+        def results():
+            global _WORKER
+
+            # blocks of sequences, at least 4 per process
+            bs = max(1, min(1000, -(-n // (4 * n_jobs))))
+            blocks = ((i, min(i + bs, n), form_col) for i in range(0, n, bs))
+
+            _WORKER = (self, doc, o, arg)
+            pool = ctx.Pool(n_jobs)
+            try:
+                pending = deque(
+                    pool.apply_async(func, (b,))
+                    for b in itertools.islice(blocks, 2 * n_jobs)
+                )
+                while pending:
+                    r = pending.popleft().get()
+                    for b in itertools.islice(blocks, 1):
+                        pending.append(pool.apply_async(func, (b,)))
+                    yield r
+            finally:
+                pool.terminate()
+                pool.join()
+                _WORKER = None
+
+        return results()
+
+    def _seq_items(self, doc, o, form_col='form', counts=None):
+        """A generator method that yields the pycrfsuite items (see `_item`)
+        of the sequences between consecutive offsets in `o`, pruned if
+        feature frequencies are provided (see `_extract_features`).
+
+        :param doc: data
+        :type doc: np.recarray
+        :param o: sequence offsets
+        :type o: np.array
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param counts: feature frequencies
+        :type counts: FeatureCounter or CountMinSketch
+        """
+        for ftm in self._seq_feature_matrices(doc, o, form_col):
+            yield self._ftm_items(ftm, counts)
+
+    def _ftm_items(self, ftm, counts=None):
+        """Converts a feature matrix into pycrfsuite items (see `_item`),
+        pruned if feature frequencies are provided.
+
+        :param ftm: feature matrix
+        :type ftm: list
+        :param counts: feature frequencies
+        :type counts: FeatureCounter or CountMinSketch
+        :return: items
+        :rtype: list
+        """
+        if counts is not None:
+            ftm = self._prune(ftm, counts)
+        return [self._item(fv) for fv in ftm]
+
+    def _seq_feature_matrices(self, doc, o, form_col='form'):
+        """A generator method that yields the feature matrices of the
+        sequences between consecutive offsets in `o`.
 
-            # index of the end of a sequence is recorded at the beginning
-            e = d[s]['eos']
+        The data is not copied or modified. If canonical replacements are
+        set, the feature functions see the `form` column of each sequence
+        through a `utils.CanonicalView`. If `feature_hashing` is set, the
+        features are hashed (see `ftex.FeatureTemplate.hash_fts`).
+
+        :param doc: data
+        :type doc: np.recarray
+        :param o: sequence offsets
+        :type o: np.array
+        :param form_col: name of column containing the form
+        :type form_col: str
+        """
+        d = doc
+
+        # canonical forms are computed sequence by sequence
+        canon = Canonicaliser(self.canonical) if self.canonical else None
+
+        # sequence feature extraction engine
+        if self.ft_engine == 'compiled':
+            seq_fts = self.ft_tmpl.compile()
+        else:
+            seq_fts = self.ft_tmpl.make_seq_fts
+        hsh = self.ft_tmpl.hash_fts if self.ft_tmpl.hash_bits else None
+
+        # extracting features sequences by sequence
+        for s, e in zip(o[:-1], o[1:]):
 
             # slicing a sequence
             seq = d[s:e]
+            if canon:
+                seq = CanonicalView(seq, canon.forms(seq['form'].tolist()))
 
-            ft_seq = np.zeros(len(seq), dtype=dt)
+            # extracting the features of the sequence
+            ftm = seq_fts(seq, form_col=form_col)
+            if hsh:
+                ftm = hsh(ftm)
+            yield ftm
 
-            # extracting the features
-            for i in range(len(seq)):
-                ft_seq[i] = tuple(self.ft_tmpl.make_fts(seq, i,
-                                                        form_col=form_col))
+    def _count_features(self, data, form_col='form', n_jobs=1, spills=None,
+                        lbl_col=None):
+        """Counts the features extracted from the data, exactly or with a
+        count-min sketch if `ft_sketch_width` is set.
 
-            # moving the start index
-            s = e
+        If spill file paths are provided, one per data chunk, the feature
+        matrices and the labels of each chunk are written to its spill file,
+        so that they can be pruned without extracting the features or reading
+        the data again (see `_read_spill`).
 
-            sc += 1
+        :param data: data
+        :type data: np.recarray or ShardedCorpus
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param n_jobs: number of feature extraction processes
+        :type n_jobs: int
+        :param spills: spill file paths
+        :type spills: list
+        :param lbl_col: label column name
+        :type lbl_col: str
+        :return: feature frequencies
+        :rtype: FeatureCounter or CountMinSketch
+        """
+        w = self.ft_sketch_width
+        cnt = CountMinSketch(w) if w else FeatureCounter()
+        for k, chunk in enumerate(data_chunks(data)):
+            o = sequence_offsets(chunk)
+            blocks = self._map_blocks(_worker_counts, chunk, o, form_col,
+                                      n_jobs, spills is not None)
+            if blocks is None:
+                blocks = self._count_blocks(chunk, o, form_col, cnt,
+                                            spills is not None)
+            else:
+                blocks = self._merge_counts(blocks, cnt)
+            if spills is None:
+                for _ in blocks:
+                    pass
+                continue
+            y = ([l[0] for l in s] for s in gsequences(chunk, [lbl_col]))
+            with open(spills[k], 'wb') as f:
+                for _, ftms, _ in blocks:
+                    _dump_block(f, 'ftms', list(zip(ftms, y)))
+                _dump_block(f, 'end', None)
+        return cnt
+
+    def _count_blocks(self, doc, o, form_col, cnt, spill=False):
+        """A generator method that counts the features of the sequences
+        between consecutive offsets in `o` in this process, and yields blocks
+        of up to 1000 sequences like `_worker_counts`.
 
-            # yielding a feature sequence
-            yield ft_seq
+        :param doc: data
+        :type doc: np.recarray
+        :param o: sequence offsets
+        :type o: np.array
+        :param form_col: name of column containing the form
+        :type form_col: str
+        :param cnt: feature frequencies
+        :type cnt: FeatureCounter or CountMinSketch
+        :param spill: yield the encoded feature matrices
+        :type spill: bool
+        """
+        ftms = []
+        for ftm in self._seq_feature_matrices(doc, o, form_col):
+            cnt.update_fts(ftm)
+            if spill:
+                ftms.append(_encode_items(ftm))
+                if len(ftms) == 1000:
+                    yield None, ftms, None
+                    ftms = []
+        yield None, ftms if spill else None, None
+
+    def _merge_counts(self, blocks, cnt):
+        """A generator method that adds the feature frequencies and the
+        profiles of the blocks of `_worker_counts` to `cnt` and to the
+        profile of the feature template, and yields the blocks.
+
+        :param blocks: block results
+        :type blocks: generator
+        :param cnt: feature frequencies
+        :type cnt: FeatureCounter or CountMinSketch
+        """
+        for b in blocks:
+            c, _, prof = b
+            if prof is not None:
+                self.ft_tmpl.profile.merge(prof)
+            cnt.update_counts(c)
+            yield b
+
+    @staticmethod
+    def _read_spill(sp):
+        """A generator that yields the feature matrices and the labels of the
+        sequences stored in a spill file (see `_count_features`).
+
+        :param sp: file path
+        :type sp: str
+        """
+        with open(sp, 'rb') as f:
+            while True:
+                k, v = pickle.load(f)
+                if k == 'end':
+                    break
+                for ftm, y in pickle.loads(zlib.decompress(v)):
+                    yield _decode_items(ftm), y
+
+    def _spilled_ftms(self, sp, ys):
+        """A generator method that yields the feature matrices stored in a
+        spill file and appends the labels of each sequence to `ys` before
+        yielding its feature matrix.
+
+        :param sp: file path
+        :type sp: str
+        :param ys: labels
+        :type ys: collections.deque
+        """
+        for ftm, y in self._read_spill(sp):
+            ys.append(y)
+            yield ftm
+
+    def _prune(self, ftm, counts):
+        """Drops the features less frequent than `ft_min_freq` from a feature
+        matrix and adds the numbers of feature occurrences kept and dropped to
+        the counts of each template entry in `pruning`.
+
+        :param ftm: feature matrix
+        :type ftm: list
+        :param counts: feature frequencies
+        :type counts: FeatureCounter or CountMinSketch
+        :return: feature matrix
+        :rtype: list
+        """
+        if not ftm:
+            return ftm
+        fs = [x[0] if type(x) is tuple else x for fv in ftm for x in fv]
+        keep = np.asarray(counts.counts(fs)) >= self.ft_min_freq
+        keep = keep.reshape(len(ftm), -1)
+        kept = keep.sum(axis=0).tolist()
+        for j, (n, k, dr) in enumerate(self.pruning):
+            self.pruning[j] = (n, k + kept[j], dr + len(ftm) - kept[j])
+        return [[x for x, y in zip(fv, r) if y]
+                for fv, r in zip(ftm, keep.tolist())]
+
+    @staticmethod
+    def _item(fv):
+        """Converts the features of a single item into a pycrfsuite item.
+
+        :param fv: features
+        :type fv: list
+        :return: item
+        :rtype: list or dict
+        """
+        for x in fv:
+            if type(x) is tuple:
+                break
+        else:
+            return fv
+        it = {}
+        for x in fv:
+            if type(x) is tuple:
+                it[x[0]] = it.get(x[0], 0.0) + x[1]
+            else:
+                it[x] = it.get(x, 0.0) + 1.0
+        return it
 
     def train(self, data=None, form_col=None, lbl_col=None, ilbl_col=None,
-              data_cols=None, data_sep=None, dump=True):
+              data_cols=None, data_sep=None, dump=True, n_jobs=None):
         """Trains a model based on provided data and features. The default
         behaviour is to load training parameters from the global configuration,
         unless they are passed to this method.
 
-        IMPORTANT: there are two ways to pass data directly through the `data`
+        IMPORTANT: there are three ways to pass data directly through the `data`
         parameter:
 
         -- np.recarray  `data` needs to be a recarray with column names that
@@ -287,6 +945,9 @@ class CRFSTagger:
                         Column names and separator should be provided in the
                         `data_cols` and `data_sep` parameters. They should still
                         match what is expected by the feature extractor.
+        -- list         `data` can be a list of recarrays (chunks), which are
+                        processed one after the other, e.g. the splits yielded
+                        by `utils.cv_splits`, or a `utils.ShardedCorpus`.
 
         The observation, label, and inference column names can be set through
         the global configuration using the following parameter names:
@@ -319,43 +980,104 @@ class CRFSTagger:
         :type data_sep: str
         :param dump: dumps the model at specified location if True
         :type dump: bool
+        :param n_jobs: number of feature extraction processes, defaults to
+        `n_jobs` in the configuration
+        :type n_jobs: int
         """
 
         # overriding parameters
         fc = form_col if form_col else self.form_col
+        nj = n_jobs if n_jobs else self.n_jobs
         c = data_cols if data_cols else self.cols
         sep = data_sep if data_sep else self.ts
         lc = lbl_col if lbl_col else self.lbl_col
         ilc = ilbl_col if ilbl_col else self.ilbl_col
 
-        if type(data) in [np.core.records.recarray, np.ndarray]:
+        if isinstance(data, (np.ndarray, EncodedData, list, tuple,
+                             ShardedCorpus)):
             d = data
         elif type(data) == str:
-            d = parse_tsv(s=data, cols=c, ts=sep, inference_col=ilc)
+            d = parse_tsv(s=data, cols=c, ts=sep, inference_col=ilc,
+                          encode=self.encode_data, vocab=self.vocab)
         elif data is None:
             d = self.train_data
         else:
             raise ValueError('Invalid input type.')
 
-        # extract features
-        X = self._extract_features(d, fc)
-
-        # extract labels
-        y = gsequences(d, [lc])
-
         trainer = Trainer(verbose=self.verbose)
 
         # setting CRFSuite parameters
         trainer.set_params(self.cfg_crf)
 
-        for x_seq, y_seq in zip(X, y):
-            trainer.append(x_seq, [l[0] for l in y_seq])
+        # counting features for the pruning pre-pass
+        cnt = None
+        pk = None
+        dfps = None
+        spills = []
+        self.pruning = None
+        if self.ft_min_freq > 1:
+            self.pruning = [(n, 0, 0) for n in self.ft_tmpl.entry_names()]
+
+            # counting is skipped if the features are in the feature cache;
+            # each data chunk is fingerprinted once
+            if self.feature_cache:
+                dfps = [self._data_fingerprint(x, fc) for x in data_chunks(d)]
+                pk = hashlib.md5(repr([
+                    self._feature_cache_path(None, fc, dfp=x) for x in dfps
+                ]).encode('utf-8')).hexdigest()
+            if pk is None:
+                cnt = self._count_features(d, fc, nj)
+            elif not all(
+                    os.path.exists(self._feature_cache_path(None, fc, pk, x))
+                    for x in dfps):
+
+                # the features extracted by the counting pass are spilled to
+                # disk, and pruned and cached without extracting them again
+                spills = ['%s.%d.spill' % (
+                    self._feature_cache_path(None, fc, dfp=x), os.getpid())
+                    for x in dfps]
+
+        try:
+            if spills:
+                cnt = self._count_features(d, fc, nj, spills, lc)
+                for sp, dfp in zip(spills, dfps):
+                    ys = deque()
+                    X = self._extract_features(
+                        None, fc, counts=cnt, pruned=pk, dfp=dfp,
+                        ftms=self._spilled_ftms(sp, ys))
+                    for x_seq in X:
+
+                        # labels of features read from the feature cache
+                        if not ys:
+                            ys.extend(y for _, y in self._read_spill(sp))
+                        trainer.append(x_seq, ys.popleft())
+            else:
+                for k, chunk in enumerate(data_chunks(d)):
+
+                    # extract features
+                    X = self._extract_features(
+                        chunk, fc, counts=cnt, n_jobs=nj, pruned=pk,
+                        dfp=dfps[k] if dfps else None)
+
+                    # extract labels
+                    y = gsequences(chunk, [lc])
+
+                    for x_seq, y_seq in zip(X, y):
+                        trainer.append(x_seq, [l[0] for l in y_seq])
+        finally:
+            for sp in spills:
+                if os.path.exists(sp):
+                    os.remove(sp)
 
         crfs_mp = '%s.crfs' % self.model_path
         try:
             makedirs(dirname(crfs_mp))
         except OSError:
             pass
+        if self.verbose and self.pruning:
+            for n, k, dr in self.pruning:
+                print('%-20s kept %10d dropped %10d' % (n, k, dr))
+
         trainer.train(crfs_mp)
 
         self.tagger = Tagger()
@@ -367,14 +1089,14 @@ class CRFSTagger:
             pickle.dump(self.cfg, open('%s.cfg.pcl' % self.model_path, 'w'))
 
     def tag(self, data, form_col=None, ilbl_col=None, tagger=None, cols=None,
-            ts=None):
+            ts=None, n_jobs=None):
         """Tags TSV/CSV or np.recarray data using the loaded CRFSuite model.
 
         See documentation for `train` for more details on requirements for the
         data passed to this method.
 
         :param data: data
-        :type data: str or recarray
+        :type data: str or recarray or list
         :param form_col: form column name
         :type form_col: str
         :param ilbl_col: inference label column name
@@ -385,32 +1107,37 @@ class CRFSTagger:
         :type cols: str or list of str
         :param ts: tab separator for TSV
         :type ts: str
+        :param n_jobs: number of feature extraction processes, defaults to
+        `n_jobs` in the configuration
+        :type n_jobs: int
         :return: tagged data
-        :rtype: recarray
+        :rtype: recarray or list
         """
 
         fc = form_col if form_col else self.form_col
+        nj = n_jobs if n_jobs else self.n_jobs
         c = cols if cols else self.cols
         sep = ts if ts else self.ts
         ilc = ilbl_col if ilbl_col else self.ilbl_col
 
-        if type(data) in [np.core.records.recarray, np.ndarray]:
+        if isinstance(data, (np.ndarray, EncodedData, list, tuple,
+                             ShardedCorpus)):
             d = data
         elif type(data) == str:
-            d = parse_tsv(s=data, cols=c, ts=sep)
+            d = parse_tsv(s=data, cols=c, ts=sep, encode=self.encode_data,
+                          vocab=self.vocab)
         else:
             raise ValueError('Invalid input type.')
 
-        tgr = tagger
+        tgr = self._tagger(tagger)
 
-        if tgr is None and self.tagger:
-            tgr = self.tagger
-        elif tgr is None:
-            tgr = Tagger()
-            tgr.open('%s.crfs' % self.model_path)
+        # tagging chunks one by one
+        if isinstance(d, (list, tuple, ShardedCorpus)):
+            return [self.tag(x, form_col=form_col, ilbl_col=ilbl_col,
+                             tagger=tgr, n_jobs=nj) for x in d]
 
         # extracting features
-        X = self._extract_features(d, form_col=fc)
+        X = self._extract_features(d, form_col=fc, n_jobs=nj)
 
         # tagging sentences
         idx = 0
@@ -421,6 +1148,185 @@ class CRFSTagger:
 
         return d
 
+    def _tagger(self, tagger=None):
+        """Returns the provided pycrfsuite tagger, the tagger of this object,
+        or a tagger opened with the model at `model_path`.
+
+        :param tagger: CRFS tagger
+        :type tagger: Tagger
+        :return: CRFS tagger
+        :rtype: Tagger
+        """
+        if tagger is not None:
+            return tagger
+        if self.tagger:
+            return self.tagger
+        tgr = Tagger()
+        tgr.open('%s.crfs' % self.model_path)
+        return tgr
+
+    def tag_state(self, data, form_col=None, ilbl_col=None, tagger=None):
+        """Tags the data and returns a `TaggingState` that can be updated
+        with token edits by `retag`, e.g. after each edit of a document in an
+        editor. The sequences of the data are copied into the state, and the
+        predicted labels are in its inference label column.
+
+        :param data: data
+        :type data: np.recarray or EncodedData
+        :param form_col: form column name
+        :type form_col: str
+        :param ilbl_col: inference label column name
+        :type ilbl_col: str
+        :param tagger: CRFS tagger
+        :type tagger: Tagger
+        :return: tagging state
+        :rtype: TaggingState
+        """
+        d = data.decode() if isinstance(data, EncodedData) else data
+        fc = form_col if form_col else self.form_col
+        ilc = ilbl_col if ilbl_col else self.ilbl_col
+        canon = Canonicaliser(self.canonical) if self.canonical else None
+
+        seqs = []
+        forms = []
+        o = sequence_offsets(d)
+        for s, e in zip(o[:-1], o[1:]):
+            seq = d[s:e].copy()
+            seq['eos'] = -1
+            seq['eos'][0] = e - s
+            seqs.append(seq)
+            forms.append(canon.forms(seq['form'].tolist()) if canon else None)
+
+        st = TaggingState(seqs, forms, fc, ilc, canon)
+        if self.ft_engine == 'compiled':
+            st.seq_fts = self.ft_tmpl.compile()
+        else:
+            st.seq_fts = self.ft_tmpl.make_seq_fts
+
+        tgr = self._tagger(tagger)
+        for k, seq in enumerate(seqs):
+            st.items.append(self._window_items(st, k, 0, len(seq), 0))
+            self._decode_seq(st, k, tgr)
+        return st
+
+    def retag(self, state, edits, tagger=None):
+        """Applies token edits to a tagging state (see `tag_state`) and
+        re-tags the edited sequences.
+
+        An edit is a tuple `(op, k, i, values)`, where `op` is `sub`
+        (replaces the values of token `i` of sequence `k` with the column
+        values in the dict `values`), `ins` (inserts a token with the given
+        column values before token `i`) or `del` (deletes token `i`, `values`
+        is ignored). Positions refer to the sequence as left by the previous
+        edits, and sequences are never split or joined.
+
+        Window features have bounded offsets (see
+        `ftex.FeatureTemplate.radius`), so only the features of the tokens
+        within that distance of an edit are recomputed, and only the edited
+        sequences are decoded. If the template contains feature functions
+        with unknown offsets, all features of the edited sequences are
+        recomputed.
+
+        :param state: tagging state
+        :type state: TaggingState
+        :param edits: edits
+        :type edits: list
+        :param tagger: CRFS tagger
+        :type tagger: Tagger
+        :return: indices of the re-tagged sequences
+        :rtype: list
+        """
+        st = state
+        rad = self.ft_tmpl.radius()
+
+        # dirty token range of each edited sequence
+        dirty = {}
+        for op, k, i, v in edits:
+            seq = st.seqs[k]
+            if op == 'sub':
+                seq = _widen(seq, v)
+                for c, x in v.items():
+                    seq[c][i] = x
+                lo, hi, grow = i, i + 1, 0
+            elif op == 'ins':
+                seq = _widen(seq, v)
+                rec = np.zeros(1, dtype=seq.dtype)
+                for c, x in v.items():
+                    rec[c][0] = x
+                seq = np.concatenate((seq[:i], rec, seq[i:]))
+                st.items[k].insert(i, None)
+                lo, hi, grow = i, i + 1, 1
+            elif op == 'del':
+                seq = np.delete(seq, i)
+                del st.items[k][i]
+                lo, hi, grow = i, i, 0
+            else:
+                raise ValueError('Invalid edit operation: %s' % op)
+
+            seq['eos'] = -1
+            if len(seq):
+                seq['eos'][0] = len(seq)
+            st.seqs[k] = seq
+
+            # canonical forms
+            if st.canon:
+                if op == 'del':
+                    del st.forms[k][i]
+                elif op == 'ins':
+                    st.forms[k].insert(i, st.canon(seq['form'][i]))
+                elif 'form' in v:
+                    st.forms[k][i] = st.canon(seq['form'][i])
+
+            # tokens whose features may have changed
+            if rad is None:
+                dirty[k] = (0, len(seq))
+                continue
+            lo, hi = max(0, lo - rad), min(len(seq), hi + rad)
+            if k in dirty:
+                a, b = dirty[k]
+                lo, hi = min(lo, a), min(len(seq), max(hi, b + grow))
+            dirty[k] = (lo, hi)
+
+        tgr = self._tagger(tagger)
+        for k, (a, b) in dirty.items():
+            st.items[k][a:b] = self._window_items(st, k, a, b, rad)
+            self._decode_seq(st, k, tgr)
+        return sorted(dirty)
+
+    def _window_items(self, st, k, a, b, rad):
+        """Returns the items of tokens `a` to `b` of sequence `k` of a tagging
+        state. The features are extracted from the tokens within `rad` of the
+        range only, or from the whole sequence if `rad` is None.
+
+        :param st: tagging state
+        :type st: TaggingState
+        :param k: sequence index
+        :type k: int
+        :param a: start index
+        :type a: int
+        :param b: end index
+        :type b: int
+        :param rad: feature radius
+        :type rad: int
+        :return: items
+        :rtype: list
+        """
+        seq = st.seqs[k]
+        s, e = (0, len(seq)) if rad is None else \
+            (max(0, a - rad), min(len(seq), b + rad))
+        v = seq[s:e]
+        if st.canon:
+            v = CanonicalView(v, st.forms[k][s:e])
+        ftm = st.seq_fts(v, form_col=st.form_col)[a - s:b - s]
+        if self.ft_tmpl.hash_bits:
+            ftm = self.ft_tmpl.hash_fts(ftm)
+        return [self._item(fv) for fv in ftm]
+
+    def _decode_seq(self, st, k, tgr):
+        # tags sequence `k` of a tagging state
+        if len(st.seqs[k]):
+            st.seqs[k][st.ilbl_col] = tgr.tag(ItemSequence(st.items[k]))
+
     def test(self, data=None, form_col=None, ilbl_col=None, tagger=None,
              cols=None, ts=None, eval_func=None):
         """Tags TSV/CSV or np.recarray data using the loaded CRFSuite model and
@@ -444,7 +1350,7 @@ class CRFSTagger:
         :param eval_func: evaluation function name [pos, conll, bio]
         :type eval_func: str
         :return: results and tagged data pair
-        :rtype: AccuracyResults, np.recarray
+        :rtype: AccuracyResults, np.recarray or list
         """
 
         # use provided data or testing data from config file
@@ -459,11 +1365,51 @@ class CRFSTagger:
 
         # evaluating
         f = eval_func if eval_func else self.eval_func
-        r = f(d, label_col=self.lbl_col, inference_col=self.ilbl_col)
+        r = f(concat_chunks(d), label_col=self.lbl_col,
+              inference_col=self.ilbl_col)
 
         # returnning AccuracyResults and np.recarray tagged data
         return r, d
 
+    def profile_report(self):
+        """Returns the profile of the feature extraction done by this tagger
+        since it was created or since the last `reset_profile`, i.e. the time
+        and the number of distinct features of every template entry and
+        feature function (see `ftex.FeatureTemplate.profile_report`). The
+        profile includes the counting pass of `ft_min_freq` and the work of
+        all feature extraction processes, but not the features read from the
+        feature cache. None if `ft_profile` is not set.
+
+        :return: report
+        :rtype: dict
+        """
+        return self.ft_tmpl.profile_report()
+
+    def reset_profile(self):
+        """Clears the profile of feature extraction (see `profile_report`).
+        """
+        if self.ft_tmpl.profile is not None:
+            self.ft_tmpl.profile.clear()
+
+    def dump_profile(self, fp):
+        """Dumps the profile of feature extraction (see `profile_report`) in
+        JSON format in the provided file path `fp`.
+
+        :param fp: file path
+        :type fp: str
+        """
+        r = self.profile_report()
+        if r is None:
+            raise RuntimeError('Feature extraction profiling is disabled. '
+                               'Please, set `ft_profile` in the configuration.')
+        fpx = expanduser(fp)
+        try:
+            makedirs(dirname(fpx))
+        except OSError:
+            pass
+        with open(fpx, 'w') as f:
+            json.dump(r, f, indent=2)
+
     def dump_model(self, fp):
         """Dumps the CRFSuiteTagger model in provided file path `fp`.
 
@@ -509,4 +1455,71 @@ class Model:
         self.cfg = None
         self.fnx = None
         self.win_fnx = None
-        self.cols = None
\ No newline at end of file
+        self.cols = None
+
+
+class TaggingState:
+    """The state of incremental tagging (see `CRFSTagger.tag_state` and
+    `CRFSTagger.retag`): the sequences of a document as separate arrays, the
+    pycrfsuite items of their tokens, and the canonical forms of their tokens
+    if canonical replacements are used. The predicted labels are in the
+    inference label column of the sequences.
+    """
+
+    def __init__(self, seqs, forms, form_col, ilbl_col, canon=None):
+        self.seqs = seqs
+        self.items = []
+        self.forms = forms
+        self.form_col = form_col
+        self.ilbl_col = ilbl_col
+        self.canon = canon
+        self.seq_fts = None
+
+    def __len__(self):
+        return len(self.seqs)
+
+    @property
+    def data(self):
+        """The non-empty sequences concatenated into a single array.
+
+        :return: data
+        :rtype: np.array
+        """
+        seqs = [x for x in self.seqs if len(x)]
+        if not seqs:
+            return self.seqs[0][:0] if self.seqs else None
+        dt = _common_dtype([x.dtype for x in seqs])
+        d = np.concatenate([x.astype(dt) for x in seqs])
+        o = np.cumsum([0] + [len(x) for x in seqs])
+        d['eos'][o[:-1]] = o[1:]
+        return d
+
+
+def _widen(seq, v):
+    """Returns the sequence with string fields wide enough for the values in
+    `v`.
+
+    :param seq: sequence
+    :type seq: np.array
+    :param v: column values
+    :type v: dict
+    :return: sequence
+    :rtype: np.array
+    """
+    dt = []
+    wide = False
+    for n in seq.dtype.names:
+        f = seq.dtype[n]
+        if n in v and f.kind in 'SU':
+            ln = len(v[n])
+            if ln > f.itemsize // (4 if f.kind == 'U' else 1):
+                f = np.dtype('%s%d' % (f.kind, ln))
+                wide = True
+        dt.append((n, f))
+    return seq.astype(dt) if wide else seq
+
+
+def _common_dtype(dts):
+    # structured dtype with the widest string fields of all dtypes
+    return np.dtype([(n, max((x[n] for x in dts), key=lambda f: f.itemsize))
+                     for n in dts[0].names])
@@ -15,16 +15,28 @@
 __author__ = 'Aleksandar Savkov'
 
 import re
-import copy
+import operator
 import os.path
 import io
+import glob
+import hashlib
+import json
+import gzip
+import bz2
+import lzma
+import multiprocessing
 import random
 import string
+import itertools
 import configparser
 import numpy as np
 
+from collections import deque
 
-def parse_tsv(fp=None, cols=None, ts='\t', s=None, inference_col='guesstag'):
+
+def parse_tsv(fp=None, cols=None, ts='\t', s=None, inference_col='guesstag',
+              chunk_size=65536, cache=False, encode=False, vocab=None,
+              n_jobs=1, usecols=None):
     """Parses a file of TSV sequences separated by an empty line and produces
     a numpy recarray. The `cols` parameter can use a predefined set of field
     names or it can be user specific. The fields may be arbitrary in case new
@@ -38,6 +50,33 @@ def parse_tsv(fp=None, cols=None, ts='\t', s=None, inference_col='guesstag'):
 
     Note: all configurations should start with <form>
 
+    The input is read only once. Rows are collected in blocks of `chunk_size`
+    records, which are converted to arrays as they fill up, so no list of all
+    lines is kept in memory. See `iter_tsv_sequences` for a version of this
+    function that yields one sequence at a time.
+
+    If `cache` is True and a corpus cache written by `save_cached_corpus`
+    exists at `corpus_cache_path(fp)`, is newer than `fp`, was parsed with the
+    same separator, and has the expected fields, it is memory-mapped and
+    returned instead of parsing `fp`.
+
+    If `encode` is True, the data is dictionary-encoded: every string value is
+    replaced by an int32 code from a `Vocabulary`, and an `EncodedData` object
+    is returned. Pass the same `vocab` when parsing related data sets (e.g.
+    training and testing data) so that their codes are comparable.
+
+    If `n_jobs` is greater than 1, an uncompressed input file is split into
+    byte ranges at empty lines, which are parsed in a pool of `n_jobs`
+    processes (see `parse_tsv_parallel`). The result is identical to that of
+    the serial parser. String input, compressed files, and encoded data are
+    always parsed serially.
+
+    If `usecols` is given, only the listed columns (and the inference and
+    `eos` columns) are kept, in the order in which they appear in `cols`. The
+    remaining fields are skipped when the lines are split, so wide files can
+    be parsed without allocating the columns that are not used. Names in
+    `usecols` that are not in `cols` are ignored.
+
     :param fp: file path
     :type fp: str
     :param cols: column names
@@ -48,58 +87,792 @@ def parse_tsv(fp=None, cols=None, ts='\t', s=None, inference_col='guesstag'):
     :type s: str
     :param inference_col: inference column name
     :type inference_col: str
+    :param chunk_size: number of records converted to an array at once
+    :type chunk_size: int
+    :param cache: use a fresh binary corpus cache if available
+    :type cache: bool
+    :param encode: dictionary-encode the string columns
+    :type encode: bool
+    :param vocab: vocabulary used for encoding
+    :type vocab: Vocabulary
+    :param n_jobs: number of parsing processes
+    :type n_jobs: int
+    :param usecols: names of the columns to keep
+    :type usecols: list
+    :return: parsed data
+    :rtype: np.array or EncodedData
+    """
+    c = _tsv_cols(cols)
+    idx = _tsv_projection(c, usecols)
+    dt = _tsv_dtype(c, inference_col, encode, idx)
+    pad = _tsv_pad(dt, dt.names[:-2])
+
+    if encode:
+        vocab = Vocabulary() if vocab is None else vocab
+        cache = False
+
+    if cache and s is None and fp is not None:
+        data = load_cached_corpus(fp, dt, ts)
+        if data is not None:
+            return data
+
+    if n_jobs > 1 and not encode and s is None and fp is not None and \
+            file_codec(fp) is None:
+        return parse_tsv_parallel(fp, c, ts, inference_col, n_jobs,
+                                  usecols=usecols)
+
+    # blocks of parsed records
+    chunks = []
+    rows = []
+
+    # sequence start and end indices
+    starts = []
+    ends = []
+
+    rc = 0
+    with _tsv_stream(fp, s) as stream:
+        for seq in _tsv_sequences(stream, len(c), ts, pad, idx):
+            starts.append(rc)
+            rc += len(seq)
+            ends.append(rc)
+            rows.extend(vocab.encode_records(seq) if encode else seq)
+            if len(rows) >= chunk_size:
+                chunks.append(np.array(rows, dtype=dt))
+                rows = []
+
+    if rows or not chunks:
+        chunks.append(np.array(rows, dtype=dt))
+
+    data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+    data['eos'][starts] = ends
+    if encode:
+        return EncodedData(data, vocab, np.array([0] + ends, dtype=int))
+    return data
+
+
+def parse_tsv_parallel(fp, cols=None, ts='\t', inference_col='guesstag',
+                       n_jobs=None, n_ranges=None, usecols=None):
+    """Parses an uncompressed TSV file in parallel. The file is split into
+    `n_ranges` byte ranges that start and end at empty lines, i.e. sequence
+    boundaries. The ranges are parsed in a pool of `n_jobs` processes, and the
+    results are concatenated after re-basing their `eos` indices.
+
+    :param fp: file path
+    :type fp: str
+    :param cols: column names
+    :type cols: str or tuple
+    :param ts: tab separator
+    :type ts: str
+    :param inference_col: inference column name
+    :type inference_col: str
+    :param n_jobs: number of processes, defaults to the number of CPUs
+    :type n_jobs: int
+    :param n_ranges: number of byte ranges, defaults to 4 * `n_jobs`
+    :type n_ranges: int
+    :param usecols: names of the columns to keep
+    :type usecols: list
     :return: parsed data
     :rtype: np.array
     """
+    c = _tsv_cols(cols)
+    n_jobs = n_jobs if n_jobs else multiprocessing.cpu_count()
+    n_ranges = n_ranges if n_ranges else 4 * n_jobs
+    rngs = tsv_byte_ranges(fp, n_ranges)
+    args = [(fp, s, e, c, ts, inference_col, usecols) for s, e in rngs]
+
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        parts = pool.map(_parse_tsv_range, args)
+    finally:
+        pool.close()
+        pool.join()
 
+    idx = 0
+    for p in parts:
+        if len(p):
+            set_sequence_start_idx(p, idx)
+            idx += len(p)
+
+    if not parts:
+        idx = _tsv_projection(c, usecols)
+        return np.zeros(0, dtype=_tsv_dtype(c, inference_col, idx=idx))
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def tsv_byte_ranges(fp, n):
+    """Splits a TSV file into (at most) `n` byte ranges of roughly equal size.
+    Every range ends with an empty line or the end of the file, so that no
+    sequence is split between two ranges.
+
+    :param fp: file path
+    :type fp: str
+    :param n: number of ranges
+    :type n: int
+    :return: list of start and end positions
+    :rtype: list
+    """
+    size = os.path.getsize(fp)
+    bounds = [0]
+    with open(fp, 'rb') as f:
+        for k in range(1, n):
+            pos = size * k // n
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+
+            # moving to the beginning of the next line
+            f.readline()
+
+            # moving past the next empty line
+            for line in iter(f.readline, b''):
+                if not line.strip():
+                    break
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_tsv_range(args):
+    """Parses a byte range of a TSV file. Used by `parse_tsv_parallel`.
+
+    :param args: file path, start, end, columns, separator, inference column,
+    projected columns
+    :type args: tuple
+    :return: parsed data
+    :rtype: np.array
+    """
+    fp, start, end, c, ts, inference_col, usecols = args
+    with open(fp, 'rb') as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    s = io.TextIOWrapper(io.BytesIO(raw)).read()
+    return parse_tsv(s=s, cols=c, ts=ts, inference_col=inference_col,
+                     usecols=usecols)
+
+
+def iter_tsv_sequences(fp=None, cols=None, ts='\t', s=None,
+                       inference_col='guesstag', usecols=None):
+    """Returns a generator that yields the sequences of a TSV file one at a
+    time, each as a separate recarray with the same fields as the output of
+    `parse_tsv`. The `eos` index of every sequence is relative to the sequence
+    itself, i.e. each yielded array is valid data on its own. Only the current
+    sequence is held in memory.
+
+    :param fp: file path
+    :type fp: str
+    :param cols: column names
+    :type cols: str or tuple
+    :param ts: tab separator
+    :type ts: str
+    :param s: TSV string
+    :type s: str
+    :param inference_col: inference column name
+    :type inference_col: str
+    :param usecols: names of the columns to keep
+    :type usecols: list
+    """
+    c = _tsv_cols(cols)
+    idx = _tsv_projection(c, usecols)
+    dt = _tsv_dtype(c, inference_col, idx=idx)
+    pad = _tsv_pad(dt, dt.names[:-2])
+
+    with _tsv_stream(fp, s) as stream:
+        for seq in _tsv_sequences(stream, len(c), ts, pad, idx):
+            data = np.array(seq, dtype=dt)
+            data[0]['eos'] = len(data)
+            yield data
+
+
+def _tsv_cols(cols):
+    """Resolves a column template name into a tuple of column names.
+
+    :param cols: column names or template name
+    :type cols: str or tuple
+    :return: column names
+    :rtype: tuple
+    """
     ct = {
         'pos': ('form', 'postag'),
         'chunk': ('form', 'postag', 'chunktag'),
         'ne': ('form', 'postag', 'chunktag', 'netag')
     }
-    c = ct[cols] if type(cols) is str else cols
+    return ct[cols] if type(cols) is str else tuple(cols)
+
+
+def _tsv_projection(c, usecols):
+    """Resolves the names of the columns to keep into column indices.
+
+    :param c: column names
+    :type c: tuple
+    :param usecols: names of the columns to keep
+    :type usecols: list
+    :return: indices of the kept columns or None if all columns are kept
+    :rtype: tuple
+    """
+    if usecols is None:
+        return None
+    idx = tuple(i for i, x in enumerate(c) if x in usecols)
+    return None if len(idx) == len(c) else idx
+
+
+def _tsv_dtype(c, inference_col, encoded=False, idx=None):
+    """Builds the recarray data type for parsed TSV data. Fields are sized by
+    column name: the `form` column is 60 bytes wide and the other (tag)
+    columns are 10 bytes wide. If there is no `form` column in `c`, the first
+    column is taken to be the form column.
+
+    :param c: column names
+    :type c: tuple
+    :param inference_col: inference column name
+    :type inference_col: str
+    :param encoded: data type of dictionary-encoded data
+    :type encoded: bool
+    :param idx: indices of the kept columns
+    :type idx: tuple
+    :return: data type
+    :rtype: np.dtype
+    """
+    idx = range(len(c)) if idx is None else idx
+    names = tuple(c[i] for i in idx) + (inference_col, 'eos')
+    if encoded:
+        formats = ['int32' for _ in names]
+    else:
+        fc = 'form' if 'form' in c else c[0]
+        formats = ['a60' if x == fc else 'a10' for x in names[:-1]] + \
+            ['int32']
+    return np.dtype({'names': names, 'formats': formats})
+
+
+def _tsv_pad(dt, c):
+    """Values of the fields not present in the input, i.e. the empty inference
+    column(s) and the `eos` index of a non-starting record.
+
+    :param dt: data type
+    :type dt: np.dtype
+    :param c: names of the kept columns
+    :type c: tuple
+    :return: padding values
+    :rtype: tuple
+    """
+    return tuple('' for _ in range(len(dt.names) - len(c) - 1)) + (-1,)
 
+
+def _tsv_stream(fp, s):
+    """Opens a text stream over a file path or a TSV string.
+
+    :param fp: file path
+    :type fp: str
+    :param s: TSV string
+    :type s: str
+    :return: text stream
+    :rtype: FileIO or StringIO
+    """
     if s is not None:
-        stream = io.StringIO()
-        stream.write(s)
-        stream.seek(0)
+        return io.StringIO(s)
     elif fp is not None:
-        stream = open(fp, 'r')
-    else:
-        raise ValueError('fp and s values are None. At least one of them must '
-                         'be initialised.')
+        return open_file(fp, 'r')
+    raise ValueError('fp and s values are None. At least one of them must '
+                     'be initialised.')
+
+
+def open_file(fp, mode='r'):
+    """Opens a file in text mode. Files with a `.gz`, `.bz2`, `.xz`, or
+    `.lzma` extension are (de)compressed on the fly with the respective codec,
+    so no decompressed copy is ever written to disk.
+
+    :param fp: file path
+    :type fp: str
+    :param mode: file mode, e.g. 'r', 'w', or 'a'
+    :type mode: str
+    :return: text stream
+    :rtype: io.TextIOBase
+    """
+    fp = os.path.expanduser(fp)
+    codec = file_codec(fp)
+    if codec:
+        return codec.open(fp, '%st' % mode.replace('t', ''))
+    return open(fp, mode)
+
 
-    rc = count_records(stream)
-    nc = len(c) - 1
-    cs = ','.join('a10' for _ in range(nc))  # col strings
-    dt = 'a60,{}a10,int32'.format('%s,' % cs if cs else '')
+def file_codec(fp):
+    """Returns the compression module matching the extension of a file path,
+    or None if the file is not compressed.
 
-    data = np.zeros(rc, dtype=dt)
+    :param fp: file path
+    :type fp: str
+    :return: compression module
+    :rtype: module
+    """
+    codecs = {'.gz': gzip, '.bz2': bz2, '.xz': lzma, '.lzma': lzma}
+    return codecs.get(os.path.splitext(fp)[1].lower())
 
-    names = c + (inference_col, 'eos')
-    data.dtype.names = names
 
-    idx = 0
-    start = 0
-    for line in stream.readlines():
-        if line.strip() == '':
-            data[start]['eos'] = idx
-            start = idx
+def _tsv_sequences(stream, nc, ts, pad, idx=None):
+    """Reads a TSV stream line by line and yields the records of each sequence
+    as a list of tuples. Consecutive, leading, and trailing empty lines do not
+    produce empty sequences. If `idx` is given, only the fields at these
+    indices are kept, and the line is not split past the last of them.
+
+    :param stream: text stream
+    :type stream: FileIO or StringIO
+    :param nc: number of columns to keep
+    :type nc: int
+    :param ts: tab separator
+    :type ts: str
+    :param pad: values of the fields missing from the input
+    :type pad: tuple
+    :param idx: indices of the kept fields
+    :type idx: tuple
+    """
+    if idx is not None:
+        get = operator.itemgetter(*idx) if len(idx) > 1 else \
+            lambda x: tuple(x[i] for i in idx)
+        ms = max(idx) + 1 if idx else 0
+    seq = []
+    for line in stream:
+        line = line.strip()
+        if line == '':
+            if seq:
+                yield seq
+                seq = []
             continue
-        # Note: len(c) is there to handle input data with more columns than
+        # Note: `nc` is there to handle input data with more columns than
         # declared in the `cols` parameter.
-        line_cols = line.strip().split(ts)
-        empty_cols = ()
-        if len(names) > len(c) + 1:
-            empty_cols = \
-                tuple('' for _ in range(len(names) - len(c) - 1))
-        data[idx] = tuple(line_cols[:len(c)]) + empty_cols + (-1,)
-        idx += 1
-    if start < len(data):
-        data[start]['eos'] = idx
+        if idx is None:
+            seq.append(tuple(line.split(ts)[:nc]) + pad)
+        else:
+            seq.append(get(line.split(ts, ms)) + pad)
+    if seq:
+        yield seq
+
+
+def save_corpus(data, fp):
+    """Writes parsed data, including the `eos` index column, to a binary file
+    that can be memory-mapped by `load_corpus`.
+
+    :param data: data
+    :type data: np.array
+    :param fp: file path
+    :type fp: str
+    """
+    with open(fp, 'wb') as f:
+        np.save(f, data, allow_pickle=False)
+
+
+def load_corpus(fp, mmap_mode='c'):
+    """Opens a binary corpus file written by `save_corpus`. The data is
+    memory-mapped rather than read, so opening is independent of corpus size.
+    The default copy-on-write mode allows the data to be tagged in memory
+    without modifying the file.
+
+    :param fp: file path
+    :type fp: str
+    :param mmap_mode: numpy memory-map mode, or None to read into memory
+    :type mmap_mode: str
+    :return: data
+    :rtype: np.memmap
+    """
+    return np.load(fp, mmap_mode=mmap_mode, allow_pickle=False)
+
+
+def corpus_cache_path(fp):
+    """Returns the path of the binary corpus cache of a TSV file.
+
+    :param fp: TSV file path
+    :type fp: str
+    :return: cache file path
+    :rtype: str
+    """
+    return '%s.npy' % fp
+
+
+def data_fingerprint(data, cols=None):
+    """Returns an MD5 hex digest of the values of some columns of the data and
+    of its sequence boundaries. Dictionary-encoded data is hashed by value, so
+    the digest does not depend on the vocabulary codes.
+
+    :param data: data
+    :type data: np.array or EncodedData
+    :param cols: names of the columns, defaults to all but `eos`
+    :type cols: list
+    :return: digest
+    :rtype: str
+    """
+    h = hashlib.md5()
+    names = data.dtype.names
+    for n in sorted(cols if cols is not None else names):
+        if n == 'eos' or n not in names:
+            continue
+        h.update(('%s\x00' % n).encode('utf-8'))
+        if isinstance(data, EncodedData):
+            h.update('\x00'.join(data[n].tolist()).encode('utf-8'))
+        else:
+            c = np.ascontiguousarray(data[n])
+            h.update(c.dtype.str.encode('utf-8'))
+            h.update(c.tobytes())
+    h.update(np.asarray(sequence_offsets(data), dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def file_fingerprint(fp, block_size=1 << 20):
+    """Returns an MD5 hex digest of the contents of a file.
+
+    :param fp: file path
+    :type fp: str
+    :param block_size: read size
+    :type block_size: int
+    :return: digest
+    :rtype: str
+    """
+    h = hashlib.md5()
+    with open(fp, 'rb') as f:
+        for b in iter(lambda: f.read(block_size), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+def _corpus_cache_meta(dt, ts):
+    """Returns the parsing parameters stored next to a corpus cache: the
+    column separator and the names of the (kept) columns.
+
+    :param dt: data type
+    :type dt: np.dtype
+    :param ts: tab separator
+    :type ts: str
+    :return: parameters
+    :rtype: dict
+    """
+    return {'ts': ts, 'cols': list(dt.names)}
+
+
+def save_cached_corpus(data, fp, ts='\t'):
+    """Writes the binary corpus cache of a TSV file (see `save_corpus`) and
+    the parameters it was parsed with, which are checked by
+    `load_cached_corpus`.
+
+    :param data: data
+    :type data: np.array
+    :param fp: TSV file path
+    :type fp: str
+    :param ts: tab separator used to parse the file
+    :type ts: str
+    """
+    cp = corpus_cache_path(fp)
+    save_corpus(data, cp)
+    with open('%s.json' % cp, 'w') as f:
+        json.dump(_corpus_cache_meta(data.dtype, ts), f)
+
+
+def load_cached_corpus(fp, dt=None, ts='\t'):
+    """Loads the binary corpus cache of a TSV file if it exists, it is newer
+    than the TSV file, and it was written by `save_cached_corpus` with the
+    same separator. If a data type is provided, the cache must match it,
+    i.e. it must have been parsed with the same columns.
+
+    :param fp: TSV file path
+    :type fp: str
+    :param dt: expected data type
+    :type dt: np.dtype
+    :param ts: tab separator
+    :type ts: str
+    :return: data or None if there is no usable cache
+    :rtype: np.memmap
+    """
+    cp = corpus_cache_path(fp)
+    try:
+        if os.path.getmtime(cp) < os.path.getmtime(fp):
+            return None
+        with open('%s.json' % cp) as f:
+            meta = json.load(f)
+        data = load_corpus(cp)
+    except (OSError, ValueError):
+        return None
+    if meta != _corpus_cache_meta(data.dtype, ts):
+        return None
+    if dt is not None and data.dtype != dt:
+        return None
     return data
 
 
+class Vocabulary:
+    """A table of string values shared by the columns of dictionary-encoded
+    data. Every distinct value is assigned a consecutive integer code.
+    """
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self.index = {}
+        self._array = None
+        for x in strings:
+            self.encode(x)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, s):
+        return s in self.index
+
+    def encode(self, s):
+        """Returns the code of a string value, adding it to the table if it is
+        not present.
+
+        :param s: value
+        :type s: str
+        :return: code
+        :rtype: int
+        """
+        try:
+            return self.index[s]
+        except KeyError:
+            code = self.index[s] = len(self.strings)
+            self.strings.append(s)
+            return code
+
+    def decode(self, code):
+        """Returns the string value of a code.
+
+        :param code: code
+        :type code: int
+        :return: value
+        :rtype: str
+        """
+        return self.strings[code]
+
+    def encode_records(self, records):
+        """Encodes a list of parsed records, i.e. tuples of string values
+        followed by an `eos` index.
+
+        :param records: records
+        :type records: list of tuple
+        :return: encoded records
+        :rtype: list of tuple
+        """
+        enc = self.encode
+        return [tuple(enc(x) for x in r[:-1]) + (r[-1],) for r in records]
+
+    def array(self):
+        """Returns the table as a numpy object array, which can be indexed with
+        an array of codes to decode a whole column at once.
+
+        :return: values
+        :rtype: np.array
+        """
+        if self._array is None or len(self._array) != len(self.strings):
+            self._array = np.array(self.strings, dtype=object)
+        return self._array
+
+    def __getstate__(self):
+        return {'strings': self.strings}
+
+    def __setstate__(self, state):
+        self.__init__(state['strings'])
+
+
+class EncodedData:
+    """Dictionary-encoded data. Holds a structured array of int32 codes with
+    the same fields as the output of `parse_tsv` and the `Vocabulary` used to
+    encode it. The `eos` field is not encoded.
+
+    Indexing follows the recarray interface used throughout this library:
+    integers return a record (`EncodedRecord`) that decodes its fields on
+    access, slices, index and boolean arrays, and lists of field names return
+    `EncodedData`, and a field name returns the decoded column. The codes are available in `codes`
+    for integer comparisons. `offsets` holds the sequence index built during
+    parsing (see `sequence_offsets`), if any.
+    """
+
+    def __init__(self, codes, vocab, offsets=None):
+        self.codes = codes
+        self.vocab = vocab
+        self.offsets = offsets
+
+    @property
+    def dtype(self):
+        return self.codes.dtype
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for i in range(len(self.codes)):
+            yield EncodedRecord(self, i)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key == 'eos':
+                return self.codes[key]
+            return self.vocab.array()[self.codes[key]]
+        if isinstance(key, (slice, list, np.ndarray)):
+            return EncodedData(self.codes[key], self.vocab)
+        return EncodedRecord(self, key)
+
+    def decode(self):
+        """Returns a decoded copy of the data as a recarray with unicode string
+        fields.
+
+        :return: data
+        :rtype: np.array
+        """
+        names = self.codes.dtype.names
+        cols = [self[n] for n in names]
+        formats = [
+            'int32' if n == 'eos'
+            else 'U%s' % max([len(x) for x in c] + [1])
+            for n, c in zip(names, cols)
+        ]
+        data = np.zeros(len(self), dtype={'names': names, 'formats': formats})
+        for n, c in zip(names, cols):
+            data[n] = c
+        return data
+
+
+class EncodedRecord:
+    """A single record of `EncodedData`. Fields are decoded on access and
+    encoded on assignment. Fields can be accessed by name or position.
+    """
+
+    __slots__ = ('data', 'idx')
+
+    def __init__(self, data, idx):
+        self.data = data
+        self.idx = idx
+
+    def _name(self, key):
+        return self.data.codes.dtype.names[key] if type(key) is int else key
+
+    def __getitem__(self, key):
+        name = self._name(key)
+        code = self.data.codes[name][self.idx]
+        return code if name == 'eos' else self.data.vocab.strings[code]
+
+    def __setitem__(self, key, value):
+        name = self._name(key)
+        if name != 'eos':
+            value = self.data.vocab.encode(value)
+        self.data.codes[name][self.idx] = value
+
+    def __len__(self):
+        return len(self.data.codes.dtype.names)
+
+    def __iter__(self):
+        for name in self.data.codes.dtype.names:
+            yield self[name]
+
+
+class CanonicalView:
+    """A read-only view of a data sequence with the values of one column
+    replaced by canonical forms (see `Canonicaliser`). The underlying data is
+    neither copied nor modified. Columns and records are accessed as in the
+    underlying data.
+    """
+
+    def __init__(self, data, forms, col='form'):
+        self.data = data
+        self.forms = forms
+        self.col = col
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if type(key) is str:
+            return np.array(self.forms) if key == self.col else self.data[key]
+        return CanonicalRecord(self, key)
+
+
+class CanonicalRecord:
+    """A single record of a `CanonicalView`."""
+
+    __slots__ = ('view', 'idx')
+
+    def __init__(self, view, idx):
+        self.view = view
+        self.idx = idx
+
+    def __getitem__(self, key):
+        if key == self.view.col:
+            return self.view.forms[self.idx]
+        return self.view.data[self.idx][key]
+
+
+def is_sharded(fp):
+    """Checks if a data path refers to several files, i.e. if it is a glob
+    pattern or a manifest file (see `shard_paths`).
+
+    :param fp: data path
+    :type fp: str
+    :return: True if the path refers to shards
+    :rtype: bool
+    """
+    return glob.has_magic(fp) or fp.endswith('.manifest')
+
+
+def shard_paths(fp):
+    """Returns the list of shard files a data path refers to. A glob pattern is
+    expanded and sorted. A manifest file (`.manifest` extension) lists one file
+    path per line; relative paths are relative to the manifest directory, and
+    empty lines and lines starting with `#` are skipped. Any other path is
+    returned as the only shard.
+
+    :param fp: glob pattern, manifest file path, or file path
+    :type fp: str
+    :return: shard file paths
+    :rtype: list
+    """
+    fp = os.path.expanduser(fp)
+    if glob.has_magic(fp):
+        return sorted(glob.glob(fp))
+    if fp.endswith('.manifest'):
+        d = os.path.dirname(fp)
+        with open_file(fp) as f:
+            paths = [x.strip() for x in f]
+        return [os.path.join(d, os.path.expanduser(x)) for x in paths
+                if x and not x.startswith('#')]
+    return [fp]
+
+
+class ShardedCorpus:
+    """Data stored in several TSV files (shards). Iterating over a sharded
+    corpus parses and yields the shards one at a time, in order, so the whole
+    corpus is never held in memory. With `n_jobs` greater than 1 the next
+    shards are parsed ahead in a process pool while the current one is being
+    consumed. The keyword arguments are passed on to `parse_tsv`.
+    """
+
+    def __init__(self, paths, n_jobs=1, **kwargs):
+        self.paths = paths
+        self.n_jobs = n_jobs
+        self.kwargs = kwargs
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        # encoding needs the shared vocabulary of this process
+        if self.n_jobs < 2 or self.kwargs.get('encode'):
+            for fp in self.paths:
+                yield parse_tsv(fp, **self.kwargs)
+            return
+
+        pool = multiprocessing.Pool(self.n_jobs)
+        try:
+            paths = iter(self.paths)
+            pending = deque(
+                pool.apply_async(parse_tsv, (fp,), self.kwargs)
+                for fp in itertools.islice(paths, self.n_jobs)
+            )
+            while pending:
+                d = pending.popleft().get()
+                for fp in itertools.islice(paths, 1):
+                    pending.append(
+                        pool.apply_async(parse_tsv, (fp,), self.kwargs))
+                yield d
+        finally:
+            pool.terminate()
+            pool.join()
+
+
 def count_records(f):
     """Counts the number of empty lines in a file.
 
@@ -116,19 +889,31 @@ def count_records(f):
     return c
 
 
-def export(data, f, cols=None, ts='\t'):
+def export(data, f, cols=None, ts='\t', block_size=65536):
     """ Exports recarray to a TSV sequence file, where sequences are divided by
     empty lines.
 
+    The data is formatted in blocks of whole sequences of about `block_size`
+    records: every column of a block is converted to strings at once (byte
+    strings are decoded as UTF-8), and each block is written with a single
+    call to `f.write`.
+
     :param data: data
-    :type data: np.array
-    :param f: output stream
-    :type f: FileIO or StringIO.StringIO
+    :type data: np.array or EncodedData
+    :param f: output stream or file path (see `open_file` for compression)
+    :type f: FileIO or StringIO.StringIO or str
     :param cols: column names
     :type cols: list or str
-    :param ts:
+    :param ts: tab separator
+    :type ts: str
+    :param block_size: number of records formatted at once
+    :type block_size: int
     """
 
+    if isinstance(f, str):
+        with open_file(f, 'w') as fh:
+            return export(data, fh, cols=cols, ts=ts, block_size=block_size)
+
     # column templates
     ct = {
         'pos': ['form', 'postag', 'guesstag'],
@@ -144,25 +929,86 @@ def export(data, f, cols=None, ts='\t'):
          else ct[cols] if type(cols) is str else list(cols))
 
     rc = len(data)
-    d = data[c]
-    eos = None
-    for i in range(rc):
-        # index of the beginning of the next sequence
-        eos = data[i]['eos'] if data[i]['eos'] > 0 else eos
+    if rc == 0:
+        return
+
+    # block boundaries at the first sequence start after every `block_size`
+    # records
+    o = sequence_offsets(data)
+    bounds = np.unique(np.append(
+        o[np.searchsorted(o, np.arange(0, rc, block_size))], rc))
+
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        blk = data[s:e]
+        rows = [ts.join(x) for x in zip(*[_str_column(blk[n]) for n in c])]
+
+        # sequence offsets within the block
+        so = o[(o >= s) & (o <= e)] - s
+        f.write('\n\n'.join('\n'.join(rows[i:j])
+                             for i, j in zip(so[:-1], so[1:])))
+        f.write('\n\n' if e < rc else '\n')
+
+
+def _str_column(a):
+    """Converts a column to a list of strings. Byte strings are decoded as
+    UTF-8.
+
+    :param a: column
+    :type a: np.array
+    :return: values
+    :rtype: list
+    """
+    if a.dtype.kind == 'S':
+        return [x.decode('utf-8') for x in a.tolist()]
+    elif a.dtype.kind in 'UO':
+        return [str(x) for x in a.tolist()]
+    return a.astype(str).tolist()
 
-        # writing current entry
-        f.write(ts.join(str(x) for x in d[i]))
 
-        # not writing a newline after last entry
-        if i != rc - 1:
-            f.write('\n')
+def sequence_offsets(data):
+    """Builds a CSR-style sequence index of the data: an int array of the start
+    indices of all sequences followed by the length of the data, so that
+    sequence `k` is `data[offsets[k]:offsets[k + 1]]`. Sequence starts are the
+    records with a non-negative `eos` field, hence the index does not depend on
+    the base of the `eos` values.
 
-        # writing an empty line after sequence
-        if eos == i + 1:
-            f.write('\n')
+    The index is computed with a single vectorised pass. Dictionary-encoded
+    data keeps the index built during parsing.
+
+    :param data: data
+    :type data: np.array or EncodedData
+    :return: sequence offsets
+    :rtype: np.array
+    """
+    offsets = getattr(data, 'offsets', None)
+    if offsets is not None:
+        return offsets
+    eos = data['eos']
+    starts = np.flatnonzero(eos[1:] >= 0) + 1
+    return np.concatenate(([0], starts, [len(eos)])) if len(eos) \
+        else np.zeros(1, dtype=int)
 
 
-def gsequences(data, cols=None):
+def sequence_at(data, k, offsets=None, cols=None):
+    """Returns sequence `k` of the data.
+
+    :param data: data
+    :type data: np.array
+    :param k: sequence number
+    :type k: int
+    :param offsets: sequence offsets (see `sequence_offsets`)
+    :type offsets: np.array
+    :param cols: column names
+    :type cols: list
+    :return: sequence
+    :rtype: np.array
+    """
+    o = sequence_offsets(data) if offsets is None else offsets
+    seq = data[o[k]:o[k + 1]]
+    return seq if cols is None else seq[cols]
+
+
+def gsequences(data, cols=None, offsets=None):
     """Returns a generator that yields a sequence from the provided data.
     Sequences are determined based on the `eos` field in `data`. If no column
     names are provided, all fields are included.
@@ -171,6 +1017,8 @@ def gsequences(data, cols=None):
     :type data: np.array
     :param cols: column names
     :type cols: list or str
+    :param offsets: sequence offsets (see `sequence_offsets`)
+    :type offsets: np.array
     """
     # column templates
     ct = {'pos': ['form', 'postag', 'guesstag'],
@@ -183,51 +1031,26 @@ def gsequences(data, cols=None):
     c = list(dt) if cols is None else ct[cols] if type(cols) is str else cols
 
     # sequence start and end indices
-    s, e = 0, 0
-
-    # extracting features from sequences
-    while 0 <= s < len(data):
-
-        # index of the end of a sequence is recorded at the beginning
-        e = data[s]['eos']
+    o = sequence_offsets(data) if offsets is None else offsets
 
-        # slicing a sequence
-        seq = data[s:e]
-
-        # moving the start index
-        s = e
+    for s, e in zip(o[:-1], o[1:]):
 
         # returning a sequence
-        yield seq[c]
+        yield data[s:e][c]
 
 
-def count_sequences(data):
+def count_sequences(data, offsets=None):
     """Counts the number of sequences in the data.
 
     :param data: data
     :type data: np.array
+    :param offsets: sequence offsets (see `sequence_offsets`)
+    :type offsets: np.array
     :return: number of sequences
     :rtype: int
     """
-    # sequence count
-    c = 0
-
-    # sequence start and end indices
-    s, e = 0, 0
-
-    # extracting features from sequences
-    while 0 <= s < len(data):
-
-        # index of the end of a sequence is recorded at the beginning
-        e = data[s]['eos']
-
-        # moving the start index
-        s = e
-
-        # counting up
-        c += 1
-
-    return c
+    o = sequence_offsets(data) if offsets is None else offsets
+    return len(o) - 1
 
 
 def set_sequence_start_idx(data, idx):
@@ -241,50 +1064,43 @@ def set_sequence_start_idx(data, idx):
 
     assert idx >= 0, 'Negative indices are not supported.'
 
+    eos = data['eos']
+
+    # sequence starts
+    starts = eos > 0
+
     # get the start of the second sentence (first eos index)
-    eos_idx = 1
-    while eos_idx < len(data) and data[eos_idx]['eos'] < 0:
-        eos_idx += 1
+    nxt = np.flatnonzero(eos[1:] >= 0)
+    eos_idx = nxt[0] + 1 if len(nxt) else len(eos)
 
     # index difference
-    diff = idx + eos_idx - data[0]['eos']
+    diff = idx + eos_idx - eos[0]
 
-    for i in range(len(data)):
-        if data[i]['eos'] > 0:
-            data[i]['eos'] += diff
+    eos[starts] += diff
 
 
-def weighed_split(data, proportion=0.9):
+def weighed_split(data, proportion=0.9, offsets=None):
     """Splits the data into two given a proportion.
 
     :param data: data
     :type data: np.array
     :param proportion: split proportion
     :type proportion: float
+    :param offsets: sequence offsets (see `sequence_offsets`)
+    :type offsets: np.array
     :return: data_split1, data_split2
     :rtype: np.array, np.array
     """
 
-    # sequence start and end indices
-    s, e = 0, 0
+    # sequence start indices
+    o = sequence_offsets(data) if offsets is None else offsets
 
     # ceiling
     ceil = int(proportion * len(data))
 
-    # last sentence
-    sh = 0
-
-    # extracting features from sequences
-    while 0 <= s < ceil:
-
-        # index of the end of a sequence is recorded at the beginning
-        e = data[s]['eos']
-
-        # keeping history
-        sh = s
-
-        # moving the start index
-        s = e
+    # start of the last sentence starting before the ceiling
+    k = np.searchsorted(o[:-1], ceil) - 1
+    sh = o[k] if k >= 0 else 0
 
     data_1 = data[:sh]
     data_2 = data[sh:]
@@ -294,37 +1110,188 @@ def weighed_split(data, proportion=0.9):
     return data_1, data_2
 
 
-def cv_splits(data, k=10):
+def cv_splits(data, k=10, offsets=None):
     """ Yields `k` cross-validation splits of `data`.
 
+    Each fold is obtained by rotating the sequences of the data so that the
+    testing split of the previous fold comes first, and splitting the result
+    with `weighed_split`. The rotation is never materialised: the splits are
+    views of `data`, and a split that wraps around the end of the data is
+    returned as a list of two views. No data is copied, so tagging a testing
+    split writes the inferred labels into `data`. The `eos` indices of the
+    splits are not re-based (see `sequence_offsets`).
+
     :param data: data
     :type data: np.array
     :param k: folds
     :type k: int
+    :param offsets: sequence offsets (see `sequence_offsets`)
+    :type offsets: np.array
     """
 
     assert k > 2, 'Folds value k too small (%s). Should be at least 3.' % k
 
-    # we need a copy of the data
-    d = copy.deepcopy(data)
+    o = sequence_offsets(data) if offsets is None else offsets
+
+    # record count
+    n = len(data)
+
     # calculate proportion
     prop = (float(k) - 1) / float(k)
 
-    # yield splits and remake the data
+    # ceiling
+    ceil = int(prop * n)
+
+    # rotation, i.e. index of the record the rotated data starts with
+    rot = 0
+
     for _ in range(k):
-        # split data
-        trd, ted = weighed_split(d, proportion=prop)
-        # make copies
-        d1 = copy.deepcopy(trd)
-        d2 = copy.deepcopy(ted)
-        # make new data with small split in the beginning
-        # big split indices need to start after small split
-        set_sequence_start_idx(d1, idx=len(d2))
-        # concatenate the data
-        d = np.concatenate((d2, d1))
+        # sequence starts relative to the rotation
+        starts = np.sort((o[:-1] - rot) % n) if n else o[:-1]
+
+        # start of the last sentence starting before the ceiling
+        j = np.searchsorted(starts, ceil) - 1
+        sh = starts[j] if j >= 0 else 0
+
+        trd = _rotated_split(data, rot, 0, sh)
+        ted = _rotated_split(data, rot, sh, n)
 
         yield trd, ted
 
+        # the testing split goes to the beginning
+        rot = (rot + sh) % n if n else 0
+
+
+def _rotated_split(data, rot, s, e):
+    """Returns records `s` to `e` of the data rotated to start at `rot` as a
+    view, or a list of two views if the range wraps around the end of the
+    data.
+
+    :param data: data
+    :type data: np.array
+    :param rot: rotation
+    :type rot: int
+    :param s: start index
+    :type s: int
+    :param e: end index
+    :type e: int
+    :return: split
+    :rtype: np.array or list
+    """
+    n = len(data)
+    s, e = rot + s, rot + e
+    if e <= n:
+        return data[s:e]
+    if s >= n:
+        return data[s - n:e - n]
+    return [data[s:], data[:e - n]]
+
+
+def data_chunks(data):
+    """Returns the data as an iterable of chunks. Lists of chunks and sharded
+    corpora are returned as they are, and any other data is wrapped in a list.
+
+    :param data: data or chunks
+    :type data: np.array or list or ShardedCorpus
+    :return: chunks
+    :rtype: list or ShardedCorpus
+    """
+    if isinstance(data, (list, ShardedCorpus)):
+        return data
+    return list(data) if isinstance(data, tuple) else [data]
+
+
+def concat_chunks(data):
+    """Concatenates data chunks into a single data object.
+
+    :param data: data or chunks
+    :type data: np.array or list
+    :return: data
+    :rtype: np.array or EncodedData
+    """
+    chunks = list(data_chunks(data))
+    if len(chunks) == 1:
+        return chunks[0]
+    if isinstance(chunks[0], EncodedData):
+        return EncodedData(np.concatenate([x.codes for x in chunks]),
+                           chunks[0].vocab)
+    return np.concatenate(chunks)
+
+
+class Canonicaliser:
+    """Replaces forms with canonical forms based on a dictionary of regular
+    expressions and replacements (see `canonical.REPLACEMENTS`). The result
+    is the same as trying the expressions one after the other with
+    `re.match` and replacing the form with every matching expression, i.e.
+    later expressions are matched against the replacement.
+
+    The expressions are combined into a single alternation of named groups,
+    and the name of the matching group selects the replacement. Expressions
+    that cannot be combined, e.g. ones with numbered back-references, are
+    matched one by one instead. Every form is canonicalised only once.
+    """
+
+    def __init__(self, replacements):
+        self.patterns = list(replacements.keys())
+        self.replacements = list(replacements.values())
+        self._cache = {}
+
+        # combined alternations of the expressions from a given index onwards
+        self._alts = {}
+        self._combined = not any(re.search(r'\\[1-9]', p)
+                                 for p in self.patterns)
+        self._res = [re.compile(p) for p in self.patterns]
+        try:
+            self._alt(0)
+        except re.error:
+            self._combined = False
+
+    def _alt(self, k):
+        if k not in self._alts:
+            self._alts[k] = re.compile('|'.join(
+                '(?P<r%d>%s)' % (j, self.patterns[j])
+                for j in range(k, len(self.patterns))))
+        return self._alts[k]
+
+    def _match(self, w, k):
+        # index of the first expression from `k` onwards that matches `w`
+        if k >= len(self.patterns):
+            return None
+        if self._combined:
+            m = self._alt(k).match(w)
+            return int(m.lastgroup[1:]) if m else None
+        for j in range(k, len(self.patterns)):
+            if self._res[j].match(w):
+                return j
+        return None
+
+    def __call__(self, w):
+        """Returns the canonical form of `w`.
+
+        :param w: form
+        :type w: str
+        :return: canonical form
+        :rtype: str
+        """
+        if w not in self._cache:
+            c = w
+            j = self._match(c, 0)
+            while j is not None:
+                c = self.replacements[j]
+                j = self._match(c, j + 1)
+            self._cache[w] = c
+        return self._cache[w]
+
+    def forms(self, forms):
+        """Returns the canonical forms of a list of forms.
+
+        :param forms: forms
+        :type forms: list
+        :return: canonical forms
+        :rtype: list
+        """
+        return [self(w) for w in forms]
+
 
 def expandpaths(cfg):
     """Expands tilde notation for user home directory.
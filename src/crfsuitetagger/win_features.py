@@ -130,6 +130,8 @@ def ft_emb_win(fn, fw, fp, *args, **kwargs):
     if len(fp) > 1:
         # parse specified range of the embeddings vector
         vc = parse_range(fp[1][1:-1])
+    elif hasattr(e, 'dim'):
+        vc = list(range(e.dim))
     else:
         # assume iteration over the whole vector
         vc = list(range(len(e[list(e.keys())[0]])))
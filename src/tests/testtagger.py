@@ -15,16 +15,24 @@
 __author__ = 'Aleksandar Savkov'
 
 import os
+import sys
+import subprocess
 import time
 import io
 import copy
+import configparser
+import shutil
+import json
 import crfsuitetagger.features as fts
 import crfsuitetagger.win_features as wf
-from unittest import TestCase
+import crfsuitetagger.readers as readers
+from unittest import TestCase, mock
+from collections import OrderedDict
 
 from crfsuitetagger.ftex import *
 from crfsuitetagger.utils import *
 from crfsuitetagger.eval import *
+from crfsuitetagger.tagger import CRFSTagger
 
 
 class TestUtils(TestCase):
@@ -71,6 +79,150 @@ trap\tN
 
         self.assertItemsEqual(self.data, mock_data)
 
+    def test_parse_tsv_chunks(self):
+        d = parse_tsv(self.dp_large, ('form', 'postag'), chunk_size=7)
+        self.assertTrue((d == self.data_large).all())
+        d = parse_tsv(s='\n\n%s\n\n\n' % self.data_str, cols=('form', 'postag'))
+        self.assertTrue((d == self.data).all())
+
+    def test_parse_tsv_parallel(self):
+        d = parse_tsv(self.dp_large, ('form', 'postag'), n_jobs=2)
+        self.assertTrue((d == self.data_large).all())
+        for n in [1, 3, 7, 100]:
+            rngs = tsv_byte_ranges(self.dp_large, n)
+            self.assertLessEqual(len(rngs), n)
+            self.assertEqual(rngs[-1][1], os.path.getsize(self.dp_large))
+            d = parse_tsv_parallel(self.dp_large, ('form', 'postag'),
+                                   n_jobs=2, n_ranges=n)
+            self.assertTrue((d == self.data_large).all())
+
+    def test_parse_tsv_usecols(self):
+        c = ('lemma', 'form', 'morph', 'postag')
+        s = '\n'.join('\t'.join(('x', l.split('\t')[0], 'y') +
+                                 tuple(l.split('\t')[1:])) if l else l
+                      for l in self.data_str.split('\n'))
+        d = parse_tsv(s=s, cols=c, usecols=['form', 'postag', 'netag'])
+        self.assertEqual(d.dtype, self.data.dtype)
+        self.assertTrue((d == self.data).all())
+        d = parse_tsv(s=s, cols=c, usecols=['postag'])
+        self.assertEqual(d.dtype.names, ('postag', 'guesstag', 'eos'))
+        self.assertEqual(d.dtype['postag'], np.dtype('S10'))
+        self.assertTrue((d['postag'] == self.data['postag']).all())
+        self.assertTrue((d['eos'] == self.data['eos']).all())
+
+    def test_parse_tsv_form_width(self):
+        s = 'N\tinterdisciplinary\nD\tthe'
+        d = parse_tsv(s=s, cols=('postag', 'form'))
+        self.assertEqual(d.dtype['form'], np.dtype('S60'))
+        self.assertEqual(d.dtype['postag'], np.dtype('S10'))
+        self.assertEqual(d['form'][0], b'interdisciplinary')
+        d = parse_tsv(s=s, cols=('postag', 'form'), usecols=['form'])
+        self.assertEqual(d['form'][0], b'interdisciplinary')
+
+    def test_iter_tsv_sequences(self):
+        seqs = list(iter_tsv_sequences(self.dp, ('form', 'postag')))
+        self.assertEqual(len(seqs), 2)
+        for seq, gs in zip(seqs, gsequences(self.data)):
+            self.assertEqual(seq[0]['eos'], len(seq))
+            self.assertTrue((seq[['form', 'postag']] ==
+                             gs[['form', 'postag']]).all())
+
+    def test_corpus_cache(self):
+        cp = corpus_cache_path(self.dp)
+        save_corpus(self.data, cp)
+        d = load_corpus(cp)
+        self.assertIsInstance(d, np.memmap)
+        self.assertTrue((d == self.data).all())
+        d = parse_tsv(self.dp, ('form', 'postag'), cache=True)
+        self.assertNotIsInstance(d, np.memmap)
+        save_cached_corpus(self.data, self.dp)
+        d = parse_tsv(self.dp, ('form', 'postag'), cache=True)
+        self.assertIsInstance(d, np.memmap)
+        d = parse_tsv(self.dp, ('form', 'postag'), inference_col='chunktag',
+                      cache=True)
+        self.assertNotIsInstance(d, np.memmap)
+        self.assertIsNone(load_cached_corpus(self.dp, ts=' '))
+        d = parse_tsv(self.dp, ('form', 'postag'))
+        self.assertNotIsInstance(d, np.memmap)
+        os.remove(cp)
+        os.remove('%s.json' % cp)
+
+    def test_encoded_data(self):
+        d = parse_tsv(self.dp, ('form', 'postag'), encode=True)
+        self.assertIsInstance(d, EncodedData)
+        self.assertEqual(d.codes.dtype['form'], np.dtype('int32'))
+        self.assertEqual(len(d), len(self.data))
+        self.assertEqual(d[2]['form'], 'fox')
+        self.assertEqual(d[8]['eos'], 16)
+        self.assertSequenceEqual(list(d['postag'][:3]), ['D', 'A', 'N'])
+        gs = [len(x) for x in gsequences(d, ['form', 'postag'])]
+        self.assertSequenceEqual(gs, [8, 8])
+        ex = io.StringIO()
+        export(d, ex, cols=['form', 'postag'])
+        self.assertEqual(ex.getvalue().strip(), self.data_str)
+        d[0]['guesstag'] = 'D'
+        self.assertEqual(d.decode()[0]['guesstag'], 'D')
+        v = d.vocab
+        d = parse_tsv(self.dp, ('form', 'postag'), encode=True, vocab=v)
+        self.assertEqual(len(v), len(d.vocab))
+
+    def test_encoded_data_arrays(self):
+        d = parse_tsv(self.dp, ('form', 'postag'), encode=True)
+        for k in [np.array([0, 2]), d['eos'] >= 0]:
+            self.assertIsInstance(d[k], EncodedData)
+            self.assertEqual(list(d[k]['form']), list(d['form'][k]))
+        self.assertEqual(list(d[d['eos'] >= 0]['eos']), [8, 16])
+
+    def test_compressed_io(self):
+        for ext in ['gz', 'bz2', 'xz']:
+            fp = '%s.%s' % (self.dp, ext)
+            with open_file(fp, 'w') as fh:
+                fh.write(self.data_str)
+            d = parse_tsv(fp, ('form', 'postag'))
+            self.assertTrue((d == self.data).all())
+            d = parse_tsv(fp, ('form', 'postag'), encode=True)
+            export(d, fp, cols=['form', 'postag'])
+            with open_file(fp, 'r') as fh:
+                self.assertEqual(fh.read().strip(), self.data_str)
+            os.remove(fp)
+
+    def test_sharded_corpus(self):
+        mp = '%s.manifest' % self.dp
+        with open(mp, 'w') as fh:
+            fh.write('# shards\n%s\n\n%s\n' % (os.path.basename(self.dp_large),
+                                              os.path.basename(self.dp)))
+        self.assertTrue(is_sharded(mp))
+        self.assertTrue(is_sharded('tmp/*.tmp'))
+        self.assertFalse(is_sharded(self.dp))
+        self.assertSequenceEqual(shard_paths(mp), [self.dp_large, self.dp])
+        for n_jobs in [1, 2]:
+            sc = ShardedCorpus(shard_paths(mp), n_jobs=n_jobs,
+                               cols=('form', 'postag'))
+            d = [x for x in data_chunks(sc)]
+            self.assertEqual(len(d), 2)
+            self.assertTrue((d[0] == self.data_large).all())
+            self.assertTrue((d[1] == self.data).all())
+        os.remove(mp)
+
+    def test_canonicaliser(self):
+        rep = {r'\d+': '<number>', r'<\w+>': '<tag>', r'\.\.\.+': '...',
+               r'(a)\1': 'a'}
+        c = Canonicaliser(rep)
+        self.assertEqual(c.forms(['12', '<x>', '....', 'aa', 'fox']),
+                         ['<tag>', '<tag>', '...', 'a', 'fox'])
+        c = Canonicaliser({r'\d+': '<number>', r'<\w+>': '<tag>'})
+        self.assertEqual(c('1'), '<tag>')
+        self.assertEqual(Canonicaliser({'x': 'y'})('1'), '1')
+
+    def test_canonical_view(self):
+        v = CanonicalView(self.data, ['x'] * len(self.data))
+        self.assertEqual(len(v), len(self.data))
+        self.assertEqual(v[3]['form'], 'x')
+        self.assertEqual(v[3]['postag'], self.data[3]['postag'])
+        self.assertEqual(v['form'].tolist(), ['x'] * len(self.data))
+        self.assertTrue((v['postag'] == self.data['postag']).all())
+        self.assertEqual(self.data[3]['form'], b'jumped')
+
     def test_count_records(self):
         # in case the string is changed
         rc = len([x for x in self.data_str.strip().split('\n') if x.strip()])
@@ -84,6 +236,10 @@ trap\tN
         ex = io.StringIO()
         export(self.data, ex, cols=['form', 'postag'])
         self.assertEqual(ex.getvalue().strip(), self.data_str)
+        ex = io.StringIO()
+        export(self.data_large, ex, cols=['form', 'postag'], block_size=20)
+        self.assertEqual(ex.getvalue(), '\n\n'.join(
+            [self.data_str + '\n.\t.' for _ in range(10)]) + '\n')
 
     def test_gsequence(self):
         gs = [list(x) for x in gsequences(self.data)]
@@ -105,6 +261,19 @@ trap\tN
         self.assertEqual(count_sequences(self.data), 2)
         self.assertEqual(count_sequences(self.data_large), 20)
 
+    def test_sequence_offsets(self):
+        o = sequence_offsets(self.data_large)
+        self.assertSequenceEqual(list(o[:3]), [0, 8, 17])
+        self.assertEqual(o[-1], len(self.data_large))
+        self.assertEqual(count_sequences(self.data_large, offsets=o), 20)
+        seq = sequence_at(self.data_large, 1, offsets=o)
+        self.assertEqual(len(seq), 9)
+        self.assertEqual(seq[0]['eos'], 17)
+        d = parse_tsv(self.dp_large, ('form', 'postag'), encode=True)
+        self.assertSequenceEqual(list(sequence_offsets(d)), list(o))
+        self.assertSequenceEqual(list(sequence_offsets(d[8:])),
+                                 list(o[1:] - 8))
+
     def test_weighted_split(self):
         trd, ted = weighed_split(self.data_large, proportion=0.89)
         self.assertEqual(len(trd), 144)
@@ -165,7 +334,19 @@ trap\tN
             set_sequence_start_idx(d, -10)
 
     def test_cv_splits(self):
-        pass
+        folds = list(cv_splits(self.data_large, k=3))
+        self.assertEqual(len(folds), 3)
+        trd, ted = folds[0]
+        self.assertEqual(len(trd), 110)
+        self.assertEqual(len(ted), 60)
+        self.assertTrue(np.shares_memory(ted, self.data_large))
+        for trd, ted in folds:
+            n = sum(len(x) for x in data_chunks(trd) + data_chunks(ted))
+            self.assertEqual(n, len(self.data_large))
+        trd, ted = folds[1]
+        self.assertIsInstance(trd, list)
+        self.assertEqual(len(concat_chunks(trd)), 111)
+        self.assertEqual(trd[0][0]['eos'], 119)
 
 
 class TestFtEx(TestCase):
@@ -253,6 +434,21 @@ trap\tN
 
         ftt_real.fnx['fakeres'](self.data, 0, self.cols, *ftt_real.vec[-1][1:])
 
+    def test_data_cols(self):
+        ftt = FeatureTemplate()
+        ftt.parse_ftvec_templ('word:[-1:1];npos:[0:1],2;short', {})
+        self.assertEqual(ftt.data_cols(), {'form', 'postag'})
+        ftt = FeatureTemplate(fnx=[self.fakeres])
+        ftt.parse_ftvec_templ('chunk:[0];fakeres:[0]', {})
+        self.assertIsNone(ftt.data_cols())
+
+    def test_compressed_resources(self):
+        fp = '%s.gz' % self.dp
+        with open_file(fp, 'w') as fh:
+            fh.write('ox\nick\nacross')
+        self.assertEqual(readers.read_suff(fp), {'ox', 'ick', 'across'})
+        os.remove(fp)
+
     def test_ftt_constructor(self):
         ftt = FeatureTemplate(fnx=[self.fakeres], win_fnx=[self.winfakeres])
         self.assertEqual(ftt.vec, [])
@@ -314,6 +510,118 @@ trap\tN
                 fts = ftt.make_fts(d, i)
                 self.assertItemsEqual(fts, rf)
 
+    def test_compile(self):
+        ftt = FeatureTemplate(fnx=[self.fakeres])
+        fr = {'fox': list(range(10)), 'wolf': list(range(10))}
+        ftt.add_win_features('word', [-3, -2, 4], ())
+        ftt.add_win_features('npos', [-1, 0], (2,))
+        ftt.add_win_features('fakeres', [0], (fr, '0'))
+        ftt.add_win_features('word', [4], ())
+        ftt.add_win_features('npos', [-2, 0, 1], (3,))
+        ftt.add_win_features('npos', [0], (2,))
+        seq_fts = ftt.compile()
+        for d in gsequences(self.data, cols=['form', 'postag']):
+            d = d.astype([('form', 'U60'), ('postag', 'U10')])
+            self.assertEqual(seq_fts(d),
+                             [ftt.make_fts(d, i) for i in range(len(d))])
+
+    def test_make_seq_fts(self):
+        ftt = FeatureTemplate(fnx=[self.fakeres])
+        fr = {'fox': list(range(10)), 'wolf': list(range(10))}
+        ftt.parse_ftvec_templ('word:[-9:3];pos:[-1:1];short;ln:[0:9]', {})
+        ftt.add_win_features('npos', [-3, 0, 6], (2,))
+        ftt.add_win_features('fakeres', [0], (fr, '0'))
+        ftt.add_win_features('fakeres', [0], (fr, '0'))
+        ftt.add_win_features('short', [0], ())
+        for d in gsequences(self.data, cols=['form', 'postag']):
+            d = d.astype([('form', 'U60'), ('postag', 'U10')])
+            self.assertEqual(ftt.make_seq_fts(d),
+                             [ftt.make_fts(d, i) for i in range(len(d))])
+
+    def test_form_cache(self):
+        r = {'cls': {'fox': '1', 'wolf': '2'}}
+        ftt = FeatureTemplate(cache_size=4)
+        ftt.parse_ftvec_templ('word:[-1:1];can:[-1:1];cls:[0];ln:[0]', r)
+        for d in gsequences(self.data, cols=['form', 'postag']):
+            d = d.astype([('form', 'U60'), ('postag', 'U10')])
+            self.assertEqual(ftt.make_seq_fts(d),
+                             [ftt.make_fts(d, i) for i in range(len(d))])
+        self.assertEqual(len(ftt.form_cache), 4)
+        self.assertEqual(ftt.form_cache.hits, 2)
+        self.assertEqual(ftt.form_cache.misses, 14)
+
+    def test_hash_fts(self):
+        ftt = FeatureTemplate(hash_bits=8)
+        ftm = [['the', 'w[-1]=the', ('emb[0][1]', 0.5), 'longprefix[0]=x']]
+        self.assertEqual(ftt.hash_fts(ftm),
+                         [['#230', 'w#132', ('emb#132', 0.5), '#101']])
+        ftt.parse_ftvec_templ('word:[-1:1];can:[0]', {})
+        for d in gsequences(self.data, cols=['form', 'postag']):
+            d = d.astype([('form', 'U60'), ('postag', 'U10')])
+            for fv in ftt.hash_fts(ftt.make_seq_fts(d)):
+                for x in fv:
+                    self.assertLess(int(x.split('#')[1]), 256)
+
+    def test_count_min_sketch(self):
+        c = CountMinSketch(64)
+        c.update_fts([['fox', 'w[0]=fox', ('emb[0][1]', 0.5)], ['fox']])
+        self.assertEqual([int(x[0]) for x in c._idx(['w[0]=fox'])],
+                         [49, 9, 25, 44])
+        self.assertEqual([c['fox'], c['w[0]=fox'], c['emb[0][1]'],
+                          c['wolf']], [2, 1, 1, 0])
+
+    def test_profile(self):
+        seqs = [d.astype([('form', 'U60'), ('postag', 'U10')])
+                for d in gsequences(self.data, cols=['form', 'postag'])]
+        rs = []
+        for ex in ['make_seq_fts', 'compile', 'make_fts']:
+            ftt = FeatureTemplate(profile=True)
+            ftt.parse_ftvec_templ('word:[-1:1];word:[0];can:[0]', {})
+            fx = ftt.compile() if ex == 'compile' else ftt.make_seq_fts
+            for d in seqs:
+                if ex == 'make_fts':
+                    [ftt.make_fts(d, i) for i in range(len(d))]
+                else:
+                    fx(d)
+            r = ftt.profile_report()
+            rs.append([(e['entry'], e['cardinality']) for e in r['entries']])
+            calls = len(seqs) if ex != 'make_fts' else sum(map(len, seqs))
+            self.assertEqual([e['calls'] for e in r['entries']], [calls] * 5)
+            fs = {f['function']: f['cardinality'] for f in r['functions']}
+            self.assertEqual(fs, {'word': sum(e[1] for e in rs[-1][:3]),
+                                  'can': rs[-1][4][1]})
+        self.assertEqual(rs[0], rs[1])
+        self.assertEqual(rs[0], rs[2])
+        self.assertEqual(rs[0][1], rs[0][3])
+        self.assertIsNone(FeatureTemplate().profile_report())
+
+    def test_profile_cardinality(self):
+        p, q, r = FeatureProfile(64), FeatureProfile(64), FeatureProfile(64)
+        for i in range(100):
+            fs = ['w[0]=%d' % (i * 50 + j) for j in range(50)]
+            p.add(0, 0.0, fs)
+            (q if i % 2 else r).add(0, 0.0, fs)
+        self.assertEqual(len(p.kmv[0]), 64)
+        self.assertLess(abs(p.cardinality([0]) - 5000), 1500)
+        q.merge(r)
+        self.assertEqual(q.kmv[0], p.kmv[0])
+        p.clear()
+        p.add(0, 0.0, [('emb[0][0]', 0.5), ('emb[0][0]', 1.0), 'emb=None'])
+        self.assertEqual(p.cardinality([0]), 2)
+
+    def test_profile_cardinality_seed(self):
+        src = ('from crfsuitetagger.ftex import FeatureProfile\n'
+               'p = FeatureProfile(64)\n'
+               'p.add(0, 0.0, ["w[0]=%d" % i for i in range(5000)])\n'
+               'print(p.cardinality([0]))\n')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        cs = set()
+        for seed in ['1', '2']:
+            env['PYTHONHASHSEED'] = seed
+            cs.add(subprocess.check_output([sys.executable, '-c', src],
+                                           env=env))
+        self.assertEqual(len(cs), 1)
+
     def test_word(self):
         for i in [-4, -1, 0, 2]:
             w = fts.ft_word(self.data, 2, self.cols, i)
@@ -347,6 +655,9 @@ trap\tN
             rw = 'can[%s]=%s' % (i, rwv)
             self.assertEqual(w, rw)
 
+    def test_can_shape(self):
+        self.assertEqual(fts.can_shape('Fox-12#x_\u00e9'), 'xxx*###xxx')
+
     def test_isnum(self):
         self.data[3][0] = '10'
         for i in [-4, -1, 0, 2]:
@@ -369,6 +680,41 @@ trap\tN
                 rw = 'emb[%s][%s]=%s' % (rel, j, v)
                 self.assertEqual(w, rw)
 
+    def test_emb_weighted(self):
+        fp = '%s.emb' % self.dp
+        with open(fp, 'w') as fh:
+            fh.write('fox 0.5 -1\nquick 0.25    2\n')
+        e = readers.read_emb(fp)
+        os.remove(fp)
+        self.assertEqual(e.matrix.dtype, np.float32)
+        self.assertEqual(e.dim, 2)
+        d = next(gsequences(self.data, cols=['form', 'postag']))
+        d = d.astype([('form', 'U60'), ('postag', 'U10')])
+        self.assertEqual(fts.ft_emb(d, 1, self.cols, 1, 1, e),
+                         ('emb[1][1]', -1.0))
+        self.assertEqual(fts.ft_emb(d, 0, self.cols, 0, 1, e),
+                         'emb[0][1]=None')
+        ftt = FeatureTemplate()
+        ftt.parse_ftvec_templ('emb:[0:1]', {'emb': e})
+        self.assertEqual(ftt.make_seq_fts(d[:3]),
+                         [ftt.make_fts(d[:3], i) for i in range(3)])
+        self.assertEqual(ftt.make_seq_fts(d[:3])[1][1:],
+                         [('emb[0][0]', 0.25), ('emb[0][1]', 2.0),
+                          ('emb[1][0]', 0.5), ('emb[1][1]', -1.0)])
+
+    def test_read_emb(self):
+        fp = '%s.emb' % self.dp
+        with open(fp, 'w') as fh:
+            fh.write('2 2\nfox 0.5 -1\n\nquick 0.25 2\n')
+        e = readers.read_emb(fp)
+        self.assertEqual(len(e), 2)
+        self.assertEqual(e['quick'].tolist(), [0.25, 2.0])
+        with open(fp, 'w') as fh:
+            fh.write('fox 0.5 -1\nquick 0.25\n')
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            readers.read_emb(fp)
+        os.remove(fp)
+
     def test_cls(self):
         c = {'fox': 1, 'quick': 2}
         i = 2
@@ -412,6 +758,19 @@ trap\tN
             rw = 'sfx[%s]=%s' % (rel, v)
             self.assertEqual(w, rw)
 
+    def test_affix_set(self):
+        a = readers.AffixSet(['', 'a', 'ab', 'abc', 'c', 'bc', 'xabc'])
+        s = set(a)
+        for w in ['abc', 'xabc', 'zabc', 'abx', 'b', 'ba']:
+            for n in range(len(w) + 1):
+                self.assertEqual(a.longest_suffix(w, n),
+                                 fts._longest_suffix(w, s, n))
+                self.assertEqual(a.longest_prefix(w, n),
+                                 fts._longest_prefix(w, s, n))
+        self.assertEqual(a.longest_suffix('zabc', 3), 'abc')
+        self.assertEqual(a.longest_prefix('abcd', 2), 'ab')
+        self.assertIsNone(a.longest_prefix('dbc', 3))
+
     def test_pref(self):
         b = {'fo', 'qui', 'across'}
         i = 2
@@ -518,6 +877,187 @@ class TestEval(TestCase):
         self.assertAlmostEqual(float(r['Total']['precision']), 88.89)
         self.assertAlmostEqual(float(r['Total']['recall']), 80.00)
 
+    def test_encoded(self):
+        rows = []
+        for x in range(10):
+            rows.append(['bla', 'N', 'B-NP' if x % 2 else 'B-VP',
+                         'B-NP' if x % 2 else 'B-VP'])
+        rows[2][3] = 'I-NP'
+        rows[5][1] = 'V'
+        data = parse_tsv(s='\n'.join('\t'.join(x) for x in rows),
+                         cols=('form', 'postag', 'chunktag', 'guesstag'),
+                         inference_col='x', encode=True)
+        r = bio(data)
+        self.assertAlmostEqual(float(r['Total']['fscore']), 84.21)
+        self.assertAlmostEqual(float(r['Total']['precision']), 88.89)
+        self.assertAlmostEqual(float(r['Total']['recall']), 80.00)
+        r = pos(data)
+        self.assertEqual(r['Total']['accuracy'], 0.0)
+        self.assertEqual(r['N']['all'], 9.0)
+
 
 class TestTagger(TestCase):
-    pass
\ No newline at end of file
+
+    def setUp(self):
+        # each test writes to its own directory, removed even if it fails
+        self.tmp = os.path.join('tmp', self.id().split('.')[-1])
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.cfg = configparser.ConfigParser()
+        self.cfg.read_string(u'[tagger]\nmodel=%s/model\n'
+                             u'ftvec=word:[-1:1];can:[0]\ntab_sep=\\t\n'
+                             u'cols=pos\nlabel_col=postag\nencode_data=True\n'
+                             u'[crfsuite]\n[resources]\n' % self.tmp)
+
+    def test_item(self):
+        fv = ['fox', 'w[0]=fox', 'w[1]=None']
+        self.assertIs(CRFSTagger._item(fv), fv)
+        self.assertEqual(
+            CRFSTagger._item(['fox', ('emb[0][1]', 0.25), 'fox']),
+            {'fox': 2.0, 'emb[0][1]': 0.25})
+
+    def test_feature_hashing_bits(self):
+        cfg = self.cfg
+        for b in ['-1', '33', '40']:
+            cfg.set('tagger', 'feature_hashing', b)
+            with self.assertRaisesRegex(ValueError, 'between 0 and 32'):
+                CRFSTagger(cfg)
+        cfg.set('tagger', 'feature_hashing', '32')
+        self.assertEqual(CRFSTagger(cfg).ft_tmpl.hash_bits, 32)
+
+    def test_prune(self):
+        cfg = self.cfg
+        cfg.set('tagger', 'ftvec', 'word:[0];can:[0]')
+        cfg.set('tagger', 'ft_min_freq', '2')
+        data = 'The\tD\nfox\tN\n.\t.\n\nThe\tD\nwolf\tN\n.\t.'
+        t = CRFSTagger(cfg)
+        t.train(data, dump=False)
+        self.assertEqual(t.pruning, [('form', 4, 2), ('word[0]', 4, 2),
+                                     ('can[0]', 5, 1)])
+        p = t.pruning
+        t.train(data, dump=False, n_jobs=2)
+        self.assertEqual(t.pruning, p)
+        cfg.set('tagger', 'ft_sketch_width', '64')
+        t = CRFSTagger(cfg)
+        t.train(data, dump=False)
+        self.assertGreaterEqual(t.pruning[0][1], 4)
+        self.assertEqual(sum(t.pruning[0][1:]), 6)
+
+    def test_parallel_features(self):
+        data = '\n\n'.join(['The\tD\nfox\tN\n.\t.', 'A\tD\nwolf\tN\n.\t.',
+                            'wolves\tN'] * 5)
+        t = CRFSTagger(self.cfg)
+        t.train(data, dump=False, n_jobs=2)
+        d = parse_tsv(s=data, cols='pos', encode=True, vocab=t.vocab)
+        self.assertEqual([x.items() for x in t._extract_features(d, n_jobs=3)],
+                         [x.items() for x in t._extract_features(d)])
+        self.assertEqual(t.tag(d, n_jobs=3)['guesstag'].tolist(),
+                         t.tag(d)['guesstag'].tolist())
+
+    def test_feature_cache(self):
+        cfg = self.cfg
+        fc = os.path.join(self.tmp, 'fts')
+        cfg.set('tagger', 'feature_cache', fc)
+        cfg.set('tagger', 'ft_min_freq', '2')
+        data = 'The\tD\nfox\tN\n.\t.\n\nThe\tD\nwolf\tN\n.\t.'
+        t = CRFSTagger(cfg)
+        t.train(data, dump=False)
+        p = t.pruning
+        d = parse_tsv(s=data, cols='pos', encode=True, vocab=t.vocab)
+        fs = [x.items() for x in t._extract_features(d)]
+        self.assertEqual(len(os.listdir(fc)), 2)
+
+        # features are read from the cache
+        with mock.patch.object(CRFSTagger, '_seq_feature_matrices') as m:
+            self.assertEqual([x.items() for x in t._extract_features(d)], fs)
+            t.train(data, dump=False)
+            m.assert_not_called()
+        self.assertEqual(t.pruning, p)
+        self.assertEqual(len(os.listdir(fc)), 2)
+
+        # the template is part of the cache key
+        cfg.set('tagger', 'ftvec', 'word:[0]')
+        t = CRFSTagger(cfg)
+        self.assertNotEqual([x.items() for x in t._extract_features(d)], fs)
+        self.assertEqual(len(os.listdir(fc)), 3)
+
+        # so are programmatic template edits and the canonical replacements
+        # order
+        cp = t._feature_cache_path(d)
+        t.ft_tmpl.add_win_features('can', [1], ())
+        self.assertNotEqual(t._feature_cache_path(d), cp)
+        t.canonical = OrderedDict([('x+', 'x'), ('xy', 'z')])
+        cp = t._feature_cache_path(d)
+        t.canonical = OrderedDict(reversed(list(t.canonical.items())))
+        self.assertNotEqual(t._feature_cache_path(d), cp)
+
+    def test_feature_cache_shards(self):
+        cfg = self.cfg
+        cfg.set('tagger', 'ft_min_freq', '2')
+        fc = os.path.join(self.tmp, 'fts')
+        os.makedirs(fc)
+        for k, s in enumerate(['The\tD\nfox\tN\n.\t.\n\nA\tD\nfox\tN',
+                               'The\tD\nwolf\tN\n.\t.']):
+            with open(os.path.join(self.tmp, '%d.txt' % k), 'w') as f:
+                f.write(s)
+        t = CRFSTagger(cfg)
+        d = t._load_corpus(os.path.join(self.tmp, '*.txt'))
+        t.train(d, dump=False)
+        p = t.pruning
+        g = [x['guesstag'].tolist() for x in t.tag(d)]
+        cfg.set('tagger', 'feature_cache', fc)
+        t = CRFSTagger(cfg)
+        for _ in range(2):
+            t.train(d, dump=False)
+            self.assertEqual(t.pruning, p)
+            self.assertEqual(sorted(x[-4:] for x in os.listdir(fc)),
+                             ['.fts', '.fts'])
+        self.assertEqual([x['guesstag'].tolist() for x in t.tag(d)], g)
+
+    def test_retag(self):
+        cfg = self.cfg
+        cfg.set('tagger', 'ftvec', 'word:[-2:1];nword:[-1:0],2;can:[0]')
+        cfg.remove_option('tagger', 'encode_data')
+        data = 'The\tD\nfox\tN\nran\tV\n.\t.\n\nA\tD\nwolf\tN\n.\t.'
+        t = CRFSTagger(cfg)
+        d = parse_tsv(s=data, cols='pos').astype(
+            [('form', 'U10'), ('postag', 'U10'), ('guesstag', 'U10'),
+             ('eos', 'int32')])
+        self.assertEqual(t.ft_tmpl.radius(), 2)
+        t.train(d, dump=False)
+        st = t.tag_state(d)
+        self.assertEqual(st.data['guesstag'].tolist(),
+                         t.tag(d.copy())['guesstag'].tolist())
+        edits = [('sub', 0, 1, {'form': 'hippopotamus'}),
+                 ('ins', 0, 0, {'form': 'Then', 'postag': 'R'}),
+                 ('del', 1, 2, None)]
+        self.assertEqual(t.retag(st, edits), [0, 1])
+        self.assertEqual(st.data['form'].tolist(),
+                         ['Then', 'The', 'hippopotamus', 'ran', '.', 'A',
+                          'wolf'])
+        fresh = t.tag_state(st.data)
+        self.assertEqual(st.items, fresh.items)
+        self.assertEqual(st.data.tolist(), fresh.data.tolist())
+
+    def test_profile(self):
+        self.cfg.set('tagger', 'ft_profile', 'true')
+        data = '\n\n'.join(['The\tD\nfox\tN\n.\t.', 'A\tD\nwolf\tN\n.\t.',
+                            'wolves\tN'] * 5)
+        t = CRFSTagger(self.cfg)
+        t.train(data, dump=False)
+        r = t.profile_report()
+        self.assertEqual([(e['entry'], e['calls'], e['cardinality'])
+                          for e in r['entries']],
+                         [('word[-1]', 15, 5), ('word[0]', 15, 6),
+                          ('word[1]', 15, 4), ('can[0]', 15, 5)])
+        t.reset_profile()
+        t.train(data, dump=False, n_jobs=2)
+        r2 = t.profile_report()
+        self.assertEqual([(e['calls'], e['cardinality'])
+                          for e in r2['entries']],
+                         [(e['calls'], e['cardinality'])
+                          for e in r['entries']])
+        fp = os.path.join(self.tmp, 'profile.json')
+        t.dump_profile(fp)
+        with open(fp) as f:
+            self.assertEqual(json.load(f)['entries'], r2['entries'])